@@ -1,6 +1,7 @@
 # Authentication module for PhishGuard
 import os
 import jwt
+from jwt.algorithms import HMACAlgorithm
 from datetime import datetime, timedelta
 from typing import Dict, Optional
 from passlib.context import CryptContext
@@ -10,7 +11,9 @@ from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # Import database functions
-from backend.database import get_user_by_email, create_user
+from backend.database import (
+    get_user_by_email, get_user_by_id, create_user, update_user_password_hash
+)
 
 # Load environment variables
 load_dotenv()
@@ -18,10 +21,23 @@ load_dotenv()
 # JWT Configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "phishguard_secret_key")
 ALGORITHM = "HS256"
+# Key bytes prepared once instead of re-encoded on every sign/verify
+SIGNING_KEY = HMACAlgorithm(HMACAlgorithm.SHA256).prepare_key(SECRET_KEY)
+# Claims every access token we issue carries
+DECODE_OPTIONS = {"require": ["exp", "sub", "user_id"]}
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing: new hashes use argon2id, existing bcrypt hashes still
+# verify and are upgraded the next time their owner logs in
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    default="argon2",
+    argon2__type="ID",
+    argon2__time_cost=2,
+    argon2__memory_cost=19456,
+    argon2__parallelism=1,
+    deprecated="auto"
+)
 
 # OAuth2 scheme for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
@@ -31,10 +47,6 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-class TokenData(BaseModel):
-    email: Optional[str] = None
-    user_id: Optional[int] = None
-
 class UserCreate(BaseModel):
     email: str
     password: str
@@ -62,8 +74,12 @@ def authenticate_user(email: str, password: str) -> Optional[Dict]:
     user = get_user_by_email(email)
     if not user:
         return None
-    if not verify_password(password, user["password_hash"]):
+    verified, new_hash = pwd_context.verify_and_update(password, user["password_hash"])
+    if not verified:
         return None
+    if new_hash:
+        # Hash uses a deprecated scheme or cost; store the upgraded one
+        update_user_password_hash(user["id"], new_hash)
     return user
 
 def create_access_token(data: Dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -76,32 +92,40 @@ def create_access_token(data: Dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, SIGNING_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict:
-    """Get the current user from a JWT token"""
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    """Build the 401 raised for any invalid or unknown token"""
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+def decode_access_token(token: str) -> Dict:
+    """Decode and verify a JWT access token, requiring the claims we issue"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        user_id = payload.get("user_id")
-        
-        if email is None or user_id is None:
-            raise credentials_exception
-        
-        token_data = TokenData(email=email, user_id=user_id)
+        return jwt.decode(token, SIGNING_KEY, algorithms=[ALGORITHM], options=DECODE_OPTIONS)
     except jwt.PyJWTError:
-        raise credentials_exception
+        raise credentials_exception()
+
+async def get_current_user_light(token: str = Depends(oauth2_scheme)) -> Dict:
+    """Get the current user's ID and email straight from the signed JWT.
+    
+    Skips the database entirely; use this for endpoints that only need
+    current_user["id"] and current_user["email"].
+    """
+    payload = decode_access_token(token)
+    return {"id": payload["user_id"], "email": payload["sub"]}
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict:
+    """Get the current user's full database row from a JWT token"""
+    payload = decode_access_token(token)
     
-    user = get_user_by_email(token_data.email)
-    if user is None:
-        raise credentials_exception
+    user = get_user_by_id(payload["user_id"])
+    if user is None or user["email"] != payload["sub"]:
+        raise credentials_exception()
     
     return user
 
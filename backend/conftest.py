@@ -0,0 +1,21 @@
+"""
+Shared fixtures for PhishGuard backend tests
+"""
+import pytest
+
+from backend import database, payment
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the database module at a fresh SQLite file with empty caches"""
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "phishguard.db"))
+    monkeypatch.setattr(database, "_initialized", False)
+    monkeypatch.setattr(database._local, "conn", None, raising=False)
+    monkeypatch.setattr(payment, "redis_client", None)
+    database._user_id_cache.clear()
+    database._user_email_cache.clear()
+    payment._status_cache.clear()
+    database.init_db()
+    yield
+    database.get_db_connection().close()
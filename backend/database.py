@@ -1,26 +1,84 @@
 # Database module for PhishGuard
 import sqlite3
 import os
-from datetime import datetime
-from typing import Dict, List, Optional, Any
-import json
-import logging
+import asyncio
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+from cachetools import TTLCache
 from shared.logger import logger
 
 # Database setup
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'phishguard.db')
 
+# One long-lived connection per thread instead of a connect/close per query
+_local = threading.local()
+
 def get_db_connection():
-    """Create a connection to the SQLite database"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
+    """Get this thread's persistent connection to the SQLite database"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        # Autocommit mode: single statements commit on their own, and
+        # multi-statement writes open an explicit transaction()
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        conn.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "PRAGMA synchronous=NORMAL;"
+            "PRAGMA cache_size=-20000;"
+            "PRAGMA temp_store=MEMORY;"
+        )
+        _local.conn = conn
     return conn
 
-def init_db():
-    """Initialize the database with required tables"""
+@contextmanager
+def transaction(immediate: bool = False):
+    """Run the enclosed statements in one transaction on this thread's connection.
+    
+    With immediate=True the write lock is taken up front, so a transaction
+    that writes never has to upgrade a read lock mid-way.
+    """
     conn = get_db_connection()
-    cursor = conn.cursor()
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+# Short-lived cache of user rows, hit on every authenticated request.
+# Emails map to user IDs so invalidating by ID covers both lookups.
+_user_cache_lock = threading.Lock()
+_user_id_cache = TTLCache(maxsize=10_000, ttl=60)
+_user_email_cache = TTLCache(maxsize=10_000, ttl=60)
+
+def _cache_user(user: sqlite3.Row) -> None:
+    """Store a user row in the lookup caches"""
+    with _user_cache_lock:
+        _user_id_cache[user["id"]] = user
+        _user_email_cache[user["email"]] = user["id"]
+
+def invalidate_user_cache(user_id: int) -> None:
+    """Drop a cached user row so the next lookup reads fresh data"""
+    with _user_cache_lock:
+        _user_id_cache.pop(user_id, None)
+
+_initialized = False
+
+def init_db():
+    """Initialize the database with required tables (once per process)"""
+    global _initialized
+    if _initialized:
+        return
     
+    with transaction() as conn:
+        _create_tables(conn.cursor())
+    _initialized = True
+
+def _create_tables(cursor: sqlite3.Cursor) -> None:
+    """Create the tables and indexes if they don't exist yet"""
     # Create users table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -42,8 +100,8 @@ def init_db():
         stripe_subscription_id TEXT,
         plan_type TEXT NOT NULL,
         status TEXT NOT NULL,
-        current_period_start TIMESTAMP,
-        current_period_end TIMESTAMP,
+        current_period_start INTEGER,  -- Unix epoch seconds, as Stripe sends them
+        current_period_end INTEGER,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (user_id) REFERENCES users (id)
     )
@@ -62,8 +120,36 @@ def init_db():
     )
     ''')
     
-    conn.commit()
-    conn.close()
+    # Create processed_stripe_events table (webhook idempotency)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS processed_stripe_events (
+        event_id TEXT PRIMARY KEY,
+        event_type TEXT NOT NULL,
+        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Create stripe_object_events table: newest event seen per Stripe object
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stripe_object_events (
+        object_id TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        max_created_ts INTEGER NOT NULL,
+        PRIMARY KEY (object_id, event_type)
+    )
+    ''')
+    
+    # Indexes for the per-user lookups. users.email needs none: its UNIQUE
+    # constraint already creates one.
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_scan_user_date ON scan_history (user_id, scan_date DESC)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sub_user ON subscriptions (user_id, created_at DESC)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sub_stripe_id ON subscriptions (stripe_subscription_id)"
+    )
 
 # User management functions
 def create_user(email: str, password_hash: str) -> int:
@@ -76,45 +162,65 @@ def create_user(email: str, password_hash: str) -> int:
             "INSERT INTO users (email, password_hash) VALUES (?, ?)",
             (email, password_hash)
         )
-        user_id = cursor.lastrowid
-        conn.commit()
-        return user_id
+        with _user_cache_lock:
+            _user_email_cache.pop(email, None)
+        return cursor.lastrowid
     except sqlite3.IntegrityError:
         # Email already exists
         return None
-    finally:
-        conn.close()
 
-def get_user_by_email(email: str) -> Dict:
+def get_user_by_email(email: str) -> Optional[sqlite3.Row]:
     """Get user by email"""
+    with _user_cache_lock:
+        user_id = _user_email_cache.get(email)
+        user = _user_id_cache.get(user_id) if user_id is not None else None
+    if user is not None:
+        return user
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
     user = cursor.fetchone()
-    conn.close()
     
     if user:
-        return dict(user)
-    return None
+        _cache_user(user)
+    return user
 
-def get_user_by_id(user_id: int) -> Dict:
+def get_user_by_id(user_id: int) -> Optional[sqlite3.Row]:
     """Get user by ID"""
+    with _user_cache_lock:
+        user = _user_id_cache.get(user_id)
+    if user is not None:
+        return user
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     user = cursor.fetchone()
-    conn.close()
     
     if user:
-        return dict(user)
-    return None
+        _cache_user(user)
+    return user
+
+def update_user_password_hash(user_id: int, password_hash: str) -> bool:
+    """Replace a user's stored password hash"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "UPDATE users SET password_hash = ? WHERE id = ?",
+        (password_hash, user_id)
+    )
+    invalidate_user_cache(user_id)
+    
+    return cursor.rowcount > 0
 
 # Subscription management functions
 def create_subscription(user_id: int, stripe_customer_id: str, 
                        stripe_subscription_id: str, plan_type: str, 
-                       status: str, period_start: datetime, period_end: datetime) -> int:
+                       status: str, period_start: int, period_end: int) -> int:
     """Create a new subscription for a user"""
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -127,44 +233,63 @@ def create_subscription(user_id: int, stripe_customer_id: str,
         (user_id, stripe_customer_id, stripe_subscription_id, plan_type, 
          status, period_start, period_end)
     )
+    return cursor.lastrowid
+
+def create_subscription_if_missing(user_id: int, stripe_customer_id: str,
+                                   stripe_subscription_id: str, plan_type: str,
+                                   status: str, period_start: Optional[int],
+                                   period_end: Optional[int]) -> bool:
+    """Create a subscription unless one with this Stripe ID is already stored.
+    
+    Returns False if it already existed. Stripe announces a new subscription
+    through more than one webhook, in no fixed order, and whichever arrives
+    first creates the row.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
     
-    subscription_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    cursor.execute(
+        """INSERT INTO subscriptions 
+           (user_id, stripe_customer_id, stripe_subscription_id, plan_type, status, 
+            current_period_start, current_period_end) 
+           SELECT ?, ?, ?, ?, ?, ?, ?
+           WHERE NOT EXISTS (SELECT 1 FROM subscriptions WHERE stripe_subscription_id = ?)""",
+        (user_id, stripe_customer_id, stripe_subscription_id, plan_type,
+         status, period_start, period_end, stripe_subscription_id)
+    )
     
-    return subscription_id
+    return cursor.rowcount > 0
+
+# UPDATE statements for each combination of (period_start given, period_end given),
+# so SQLite only ever sees four distinct query strings
+_UPDATE_SUBSCRIPTION_SQL = {
+    (False, False): "UPDATE subscriptions SET status = ? WHERE id = ?",
+    (True, False): "UPDATE subscriptions SET status = ?, current_period_start = ? WHERE id = ?",
+    (False, True): "UPDATE subscriptions SET status = ?, current_period_end = ? WHERE id = ?",
+    (True, True): "UPDATE subscriptions SET status = ?, current_period_start = ?, current_period_end = ? WHERE id = ?",
+}
 
 def update_subscription(subscription_id: int, status: str, 
-                       period_start: datetime = None, period_end: datetime = None) -> bool:
+                       period_start: int = None, period_end: int = None) -> bool:
     """Update an existing subscription"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    update_fields = ["status = ?", "status"]
     params = [status]
-    
     if period_start:
-        update_fields.append("current_period_start = ?")
         params.append(period_start)
-    
     if period_end:
-        update_fields.append("current_period_end = ?")
         params.append(period_end)
-    
     params.append(subscription_id)
     
     cursor.execute(
-        f"UPDATE subscriptions SET {', '.join(update_fields)} WHERE id = ?",
+        _UPDATE_SUBSCRIPTION_SQL[(bool(period_start), bool(period_end))],
         params
     )
     
-    success = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
-    
-    return success
+    return cursor.rowcount > 0
 
-def get_user_subscription(user_id: int) -> Dict:
+def get_user_subscription(user_id: int) -> Optional[sqlite3.Row]:
     """Get the active subscription for a user"""
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -175,43 +300,196 @@ def get_user_subscription(user_id: int) -> Dict:
     )
     
     subscription = cursor.fetchone()
-    conn.close()
     
-    if subscription:
-        return dict(subscription)
+    return subscription
+
+def get_user_plan_usage(user_id: int) -> Optional[sqlite3.Row]:
+    """Get a user's scan count alongside their latest subscription's plan and status.
+    
+    plan_type and status are None when the user has never subscribed.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """SELECT u.scan_count, s.plan_type, s.status
+           FROM users u
+           LEFT JOIN subscriptions s ON s.id = (
+               SELECT id FROM subscriptions WHERE user_id = u.id
+               ORDER BY created_at DESC LIMIT 1
+           )
+           WHERE u.id = ?""",
+        (user_id,)
+    )
+    
+    return cursor.fetchone()
+
+def update_subscription_status_by_stripe_id(stripe_subscription_id: str, status: str) -> Optional[int]:
+    """Set the status of the subscription with this Stripe ID.
+    
+    Returns the ID of the user it belongs to, or None if we have no such
+    subscription.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "UPDATE subscriptions SET status = ? WHERE stripe_subscription_id = ? RETURNING user_id",
+        (status, stripe_subscription_id)
+    )
+    
+    # Read every returned row so the statement finishes and releases its lock
+    result = cursor.fetchall()
+    if result:
+        return result[0][0]
     return None
 
-# Scan tracking functions
-def record_scan(user_id: int, email_subject: str, is_phishing: bool, confidence: float) -> bool:
-    """Record a scan in the history and update user's scan count"""
+# Stripe webhook bookkeeping
+def mark_stripe_event_processed(event_id: str, event_type: str) -> bool:
+    """Record a Stripe event as processed.
+    
+    Returns False if it was already recorded, i.e. this delivery is a retry.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "INSERT OR IGNORE INTO processed_stripe_events (event_id, event_type) VALUES (?, ?)",
+        (event_id, event_type)
+    )
+    
+    return cursor.rowcount > 0
+
+def record_latest_stripe_event(object_id: str, event_type: str, created: int) -> bool:
+    """Remember the newest event of a type for a Stripe object.
+    
+    Returns False if an event at least as new was already handled, meaning
+    this one is stale and can be skipped.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    cursor.execute(
+        """INSERT INTO stripe_object_events (object_id, event_type, max_created_ts)
+           VALUES (?, ?, ?)
+           ON CONFLICT (object_id, event_type) DO UPDATE
+           SET max_created_ts = excluded.max_created_ts
+           WHERE excluded.max_created_ts > stripe_object_events.max_created_ts""",
+        (object_id, event_type, created)
+    )
+    
+    return cursor.rowcount > 0
+
+# Scan tracking functions
+def record_scans(scans: List[tuple]) -> bool:
+    """Record a batch of (user_id, email_subject, is_phishing, confidence) scans
+    and bump each user's scan count, all in one transaction"""
     try:
-        # Record the scan in history
-        cursor.execute(
-            """INSERT INTO scan_history 
-               (user_id, email_subject, is_phishing, confidence) 
-               VALUES (?, ?, ?, ?)""",
-            (user_id, email_subject, is_phishing, confidence)
-        )
-        
-        # Update user's scan count and last scan date
-        cursor.execute(
-            """UPDATE users 
-               SET scan_count = scan_count + 1, last_scan_date = CURRENT_TIMESTAMP 
-               WHERE id = ?""",
-            (user_id,)
-        )
-        
-        conn.commit()
+        with transaction(immediate=True) as conn:
+            # Record the scans in history
+            conn.executemany(
+                """INSERT INTO scan_history 
+                   (user_id, email_subject, is_phishing, confidence) 
+                   VALUES (?, ?, ?, ?)""",
+                scans
+            )
+            
+            # Update each user's scan count and last scan date, once per
+            # user however many of their scans are in the batch
+            scans_per_user = Counter(scan[0] for scan in scans)
+            conn.executemany(
+                """UPDATE users 
+                   SET scan_count = scan_count + ?, last_scan_date = CURRENT_TIMESTAMP 
+                   WHERE id = ?""",
+                [(count, user_id) for user_id, count in scans_per_user.items()]
+            )
+        for user_id in scans_per_user:
+            invalidate_user_cache(user_id)
         return True
     except Exception as e:
-        logger.error(f"Error recording scan: {e}")
-        conn.rollback()
+        logger.error(f"Error recording scans: {e}")
         return False
-    finally:
-        conn.close()
+
+def record_scan(user_id: int, email_subject: str, is_phishing: bool, confidence: float) -> bool:
+    """Record a scan in the history and update user's scan count"""
+    return record_scans([(user_id, email_subject, is_phishing, confidence)])
+
+# Background scan writer: under load, scans queue up and get written in
+# batches so many requests share one commit
+SCAN_BATCH_SIZE = 256
+# Tries per batch before its scans are given up on, doubling the wait each time
+SCAN_WRITE_ATTEMPTS = 3
+SCAN_WRITE_RETRY_DELAY = 0.5
+_scan_queue: Optional[asyncio.Queue] = None
+_scan_writer_task: Optional[asyncio.Task] = None
+# Queued by stop_scan_writer; the writer finishes what's ahead of it and exits
+_STOP_WRITER = object()
+
+async def _write_scans(batch: List[tuple]) -> None:
+    """Write a batch of scans, retrying if the write fails (e.g. database locked)"""
+    for attempt in range(SCAN_WRITE_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(SCAN_WRITE_RETRY_DELAY * 2 ** (attempt - 1))
+        if await asyncio.to_thread(record_scans, batch):
+            return
+    logger.error(
+        f"Lost {len(batch)} scans for users {sorted({scan[0] for scan in batch})} "
+        f"after {SCAN_WRITE_ATTEMPTS} failed writes"
+    )
+
+async def _run_scan_writer(queue: asyncio.Queue) -> None:
+    """Write queued scans, up to SCAN_BATCH_SIZE per transaction, until told to stop"""
+    while True:
+        scan = await queue.get()
+        if scan is _STOP_WRITER:
+            return
+        batch = [scan]
+        stopping = False
+        while len(batch) < SCAN_BATCH_SIZE and not queue.empty():
+            scan = queue.get_nowait()
+            if scan is _STOP_WRITER:
+                stopping = True
+                break
+            batch.append(scan)
+        await _write_scans(batch)
+        if stopping:
+            return
+
+def start_scan_writer() -> None:
+    """Start the background scan writer on the running event loop"""
+    global _scan_queue, _scan_writer_task
+    _scan_queue = asyncio.Queue()
+    _scan_writer_task = asyncio.create_task(_run_scan_writer(_scan_queue))
+
+async def stop_scan_writer() -> None:
+    """Stop the background scan writer once everything queued is written"""
+    global _scan_queue, _scan_writer_task
+    if _scan_writer_task is None:
+        return
+    queue, task = _scan_queue, _scan_writer_task
+    
+    # Let the writer finish the batch it's on and everything queued before
+    # the stop marker, so no batch is left half-written when we return
+    await queue.put(_STOP_WRITER)
+    await task
+    
+    # From here on queue_scan writes directly; pick up anything that was
+    # queued behind the stop marker
+    _scan_queue = None
+    _scan_writer_task = None
+    pending = []
+    while not queue.empty():
+        pending.append(queue.get_nowait())
+    if pending:
+        await _write_scans(pending)
+
+async def queue_scan(user_id: int, email_subject: str, is_phishing: bool, confidence: float) -> None:
+    """Hand a scan to the background writer, or write it now if the writer isn't running"""
+    scan = (user_id, email_subject, is_phishing, confidence)
+    if _scan_queue is None:
+        await asyncio.to_thread(record_scans, [scan])
+    else:
+        await _scan_queue.put(scan)
 
 def get_user_scan_count(user_id: int) -> int:
     """Get the number of scans a user has performed"""
@@ -220,13 +498,12 @@ def get_user_scan_count(user_id: int) -> int:
     
     cursor.execute("SELECT scan_count FROM users WHERE id = ?", (user_id,))
     result = cursor.fetchone()
-    conn.close()
     
     if result:
-        return result['scan_count']
+        return result[0]
     return 0
 
-def get_user_scan_history(user_id: int, limit: int = 10) -> List[Dict]:
+def get_user_scan_history(user_id: int, limit: int = 10) -> List[sqlite3.Row]:
     """Get the scan history for a user"""
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -238,10 +515,4 @@ def get_user_scan_history(user_id: int, limit: int = 10) -> List[Dict]:
         (user_id, limit)
     )
     
-    history = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    return history
-
-# Initialize the database when this module is imported
-init_db()
\ No newline at end of file
+    return cursor.fetchall()
@@ -1,26 +1,35 @@
 # Import necessary libraries for our phishing detection system
 from fastapi import FastAPI, HTTPException, status, Depends, Request, File  # FastAPI for building our web API
 from fastapi.middleware.cors import CORSMiddleware  # Allows our frontend to talk to the backend
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.middleware.gzip import GZipMiddleware  # Shrinks large responses on the wire
+from fastapi.responses import JSONResponse, RedirectResponse, Response
 from pydantic import BaseModel  # Helps validate incoming data
 from typing import List, Dict, Optional  # For type hints that make our code safer
 from datetime import datetime  # For handling dates and times
-from transformers import pipeline  # For AI-powered text analysis
+from functools import cache
 import nltk  # For processing text
 import re  # For pattern matching in text
+import json
+import math
+import asyncio  # For running blocking calls off the event loop
+import ahocorasick  # For finding many keywords in one pass
 import stripe
 
 # Import our custom modules
 from backend.auth import (
     Token, UserCreate, UserLogin, User, get_current_user,
-    register_new_user, login_user
+    get_current_user_light, register_new_user, login_user
 )
 from backend.payment import (
     PLANS, create_customer, create_checkout_session,
-    cancel_subscription, handle_webhook_event,
-    check_user_subscription_status, can_user_perform_scan
+    cancel_subscription, verify_webhook_event, handle_webhook_event,
+    check_user_subscription_status, can_user_perform_scan,
+    record_scan_usage
+)
+from backend.database import (
+    init_db, queue_scan, start_scan_writer, stop_scan_writer,
+    get_user_scan_history
 )
-from backend.database import record_scan, get_user_scan_history
 
 # Download language processing tools we need
 try:
@@ -44,8 +53,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize AI model for sentiment analysis
-sentiment_analyzer = pipeline("text-classification", model="distilbert-base-uncased-finetuned-sst-2-english")
+# Compress bigger responses (analysis results with many URLs and reasons) for
+# clients that accept gzip; requests asks for it by default and decodes it
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+# Create the database tables once the server starts, not on every import
+@app.on_event("startup")
+async def startup():
+    init_db()
+    start_scan_writer()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_scan_writer()
 
 # Pydantic models
 class EmailContent(BaseModel):
@@ -73,7 +93,39 @@ from shared.utils import (
 )
 
 # Import GPT integration
-from shared.gpt_integration import analyze_email_with_gpt, should_use_gpt
+from shared.gpt_integration import analyze_email_with_gpt_async, should_use_gpt
+
+# Words that hint the email is fishing for private info
+SENSITIVE_TERMS = ("password", "credit card", "social security", "bank account")
+
+def build_keyword_automaton() -> ahocorasick.Automaton:
+    """Build one automaton over every keyword, tagged with its category.
+    
+    Scanning an email with it is a single pass over the text, instead of
+    one substring search per keyword.
+    """
+    automaton = ahocorasick.Automaton()
+    for category, keywords in {**PHISHING_KEYWORDS, "sensitive": SENSITIVE_TERMS}.items():
+        for keyword in keywords:
+            automaton.add_word(keyword.lower(), category)
+    automaton.make_automaton()
+    return automaton
+
+KEYWORD_AUTOMATON = build_keyword_automaton()
+
+# Only the first 64 KB of a body is scanned; phishing tells sit near the
+# top, and this caps the work a huge pasted email can cause
+MAX_SCAN_CHARS = 65536
+
+# Runs of 4+ capital letters, i.e. SHOUTING
+CAPS_PATTERN = re.compile(r'[A-Z]{4,}')
+
+def has_excessive_caps(text: str, limit: int = 2) -> bool:
+    """Check whether text has more than `limit` all-caps words, stopping at the first one over"""
+    for count, _ in enumerate(CAPS_PATTERN.finditer(text), start=1):
+        if count > limit:
+            return True
+    return False
 
 # Phishing detection functions
 def extract_features(email: EmailContent) -> dict:
@@ -85,27 +137,30 @@ def extract_features(email: EmailContent) -> dict:
     - Is the sender's address fishy?
     - Is it asking for sensitive info?
     """
-    # Combine subject and body text for easier analysis
-    combined_text = f"{email.subject.lower()} {email.body.lower()}"
+    body = email.body[:MAX_SCAN_CHARS]
+    
+    # Combine subject and body text for easier analysis, lowercasing it all in one pass
+    combined_text = f"{email.subject} {body}".lower()
+    
+    # Which keyword categories show up anywhere in the email
+    matched = {category for _, category in KEYWORD_AUTOMATON.iter(combined_text)}
     
     features = {
         # Check for fishy language patterns
-        "urgency_keywords": any(kw in combined_text for kw in PHISHING_KEYWORDS['urgency']),  # "Act now!", "Urgent!"
-        "threat_keywords": any(kw in combined_text for kw in PHISHING_KEYWORDS['threat']),   # "Account suspended"
-        "action_keywords": any(kw in combined_text for kw in PHISHING_KEYWORDS['action']),  # "Click here"
-        "reward_keywords": any(kw in combined_text for kw in PHISHING_KEYWORDS['reward']),  # "You won!"
+        "urgency_keywords": "urgency" in matched,  # "Act now!", "Urgent!"
+        "threat_keywords": "threat" in matched,   # "Account suspended"
+        "action_keywords": "action" in matched,  # "Click here"
+        "reward_keywords": "reward" in matched,  # "You won!"
         
         # Look for sketchy links
-        "suspicious_urls": analyze_urls(email.body),
+        "suspicious_urls": analyze_urls(body),
         
         # Check if the sender's email looks legitimate
         "suspicious_sender": not validate_email(email.sender),
         
         # Look for other red flags
-        "poor_formatting": len(re.findall(r'[A-Z]{4,}', email.body)) > 2,  # Lots of CAPS LOCK is suspicious
-        "sensitive_requests": any(term in combined_text for term in [
-            "password", "credit card", "social security", "bank account"  # Asking for private info
-        ])
+        "poor_formatting": has_excessive_caps(body),  # Lots of CAPS LOCK is suspicious
+        "sensitive_requests": "sensitive" in matched  # Asking for private info
     }
     return features
 
@@ -129,77 +184,141 @@ def generate_summary(is_phishing: bool, risk_factors: List[str], urls: List[dict
     
     return f"⚠️ Watch out! This looks like a scam email because it {', '.join(summary_points)}. Stay safe and don't click any links!"
 
+@cache
+def get_sentiment_analyzer():
+    """Load the sentiment model on first use rather than at startup.
+    
+    It pulls in transformers/torch and a few hundred MB of weights, and
+    nothing on the /analyze path needs it.
+    """
+    from transformers import pipeline  # For AI-powered text analysis
+    return pipeline("text-classification", model="distilbert-base-uncased-finetuned-sst-2-english")
+
 def analyze_sentiment(text: str) -> dict:
-    result = sentiment_analyzer(text)
+    result = get_sentiment_analyzer()(text)
     return result[0]
 
 # API endpoints
+async def run_analysis(email: EmailContent) -> PhishingAnalysis:
+    """Score one email, asking GPT for a second opinion when the score is borderline"""
+    # Extract and analyze features
+    features = extract_features(email)
+    risk_score, risk_factors = calculate_risk_score(features)
+    
+    # Determine if we should use GPT for enhanced analysis
+    if should_use_gpt(risk_score, risk_factors):
+        # Get enhanced analysis from GPT without blocking the event loop
+        # (or a worker thread) during the API call
+        gpt_result = await analyze_email_with_gpt_async(
+            email.subject,
+            email.body,
+            email.sender,
+            risk_factors
+        )
+        
+        # If GPT analysis was successful, incorporate its findings
+        if gpt_result["success"]:
+            # Add GPT-identified risk factors
+            risk_factors.extend(gpt_result["additional_risk_factors"])
+            
+            # Recalculate risk score with GPT insights
+            # Add a small boost to the risk score for each new factor identified by GPT
+            gpt_factor_boost = 0.05 * len(gpt_result["additional_risk_factors"])
+            risk_score = min(1.0, risk_score + gpt_factor_boost)
+    
+    # Prepare analysis result
+    return PhishingAnalysis(
+        is_phishing=risk_score > 0.5,
+        confidence=risk_score,
+        risk_factors=risk_factors,
+        suspicious_urls=[URLAnalysis(**url) for url in features["suspicious_urls"]],
+        analysis_timestamp=datetime.utcnow(),
+        summary=generate_summary(
+            risk_score > 0.5,
+            risk_factors,
+            features["suspicious_urls"]
+        )
+    )
+
+async def record_analysis(user_id: int, email: EmailContent, analysis: PhishingAnalysis) -> None:
+    """Queue a finished scan to be recorded and count it against the user's plan"""
+    await queue_scan(
+        user_id=user_id,
+        email_subject=email.subject,
+        is_phishing=analysis.is_phishing,
+        confidence=analysis.confidence
+    )
+    await asyncio.to_thread(record_scan_usage, user_id)
+
 @app.post("/analyze", response_model=PhishingAnalysis)
-async def analyze_email(email: EmailContent, current_user: Dict = Depends(get_current_user)):
+async def analyze_email(email: EmailContent, current_user: Dict = Depends(get_current_user_light)):
     try:
-        # Check if user can perform a scan based on their subscription
-        if not can_user_perform_scan(current_user["id"]):
+        # Check if user can perform a scan based on their subscription. The
+        # lookup may wait on Redis or the database, so it runs off the event loop
+        if not await asyncio.to_thread(can_user_perform_scan, current_user["id"]):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Scan limit reached. Please upgrade to Pro for unlimited scans."
             )
         
-        # Extract and analyze features
-        features = extract_features(email)
-        risk_score, risk_factors = calculate_risk_score(features)
+        analysis = await run_analysis(email)
         
-        # Determine if we should use GPT for enhanced analysis
-        if should_use_gpt(risk_score, risk_factors):
-            # Get enhanced analysis from GPT
-            gpt_result = analyze_email_with_gpt(
-                email.subject,
-                email.body,
-                email.sender,
-                risk_factors
-            )
-            
-            # If GPT analysis was successful, incorporate its findings
-            if gpt_result["success"]:
-                # Add GPT-identified risk factors
-                risk_factors.extend(gpt_result["additional_risk_factors"])
-                
-                # Recalculate risk score with GPT insights
-                # Add a small boost to the risk score for each new factor identified by GPT
-                gpt_factor_boost = 0.05 * len(gpt_result["additional_risk_factors"])
-                risk_score = min(1.0, risk_score + gpt_factor_boost)
+        # Queue this scan to be recorded in the database
+        await record_analysis(current_user["id"], email, analysis)
         
-        # Prepare analysis result
-        analysis = PhishingAnalysis(
-            is_phishing=risk_score > 0.5,
-            confidence=risk_score,
-            risk_factors=risk_factors,
-            suspicious_urls=[URLAnalysis(**url) for url in features["suspicious_urls"]],
-            analysis_timestamp=datetime.utcnow(),
-            summary=generate_summary(
-                risk_score > 0.5,
-                risk_factors,
-                features["suspicious_urls"]
-            )
+        return analysis
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error analyzing email: {str(e)}"
         )
-        
-        # Record this scan in the database
-        record_scan(
-            user_id=current_user["id"],
-            email_subject=email.subject,
-            is_phishing=analysis.is_phishing,
-            confidence=analysis.confidence
+
+# Most emails one batch request may carry
+MAX_BATCH_EMAILS = 16
+
+@app.post("/analyze/batch", response_model=List[PhishingAnalysis])
+async def analyze_email_batch(emails: List[EmailContent], current_user: Dict = Depends(get_current_user_light)):
+    """Analyze several emails in one request.
+    
+    Authentication and the plan check happen once for the whole batch, and
+    any GPT calls for borderline emails run concurrently.
+    """
+    if len(emails) > MAX_BATCH_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"A batch can hold at most {MAX_BATCH_EMAILS} emails"
         )
+    
+    try:
+        subscription_status = await asyncio.to_thread(check_user_subscription_status, current_user["id"])
+        if subscription_status["scans_remaining"] < len(emails):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Not enough scans left for this batch. Please upgrade to Pro for unlimited scans."
+            )
         
-        return analysis
+        analyses = await asyncio.gather(*(run_analysis(email) for email in emails))
+        
+        for email, analysis in zip(emails, analyses):
+            await record_analysis(current_user["id"], email, analysis)
+        
+        return analyses
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error analyzing email: {str(e)}"
+            detail=f"Error analyzing emails: {str(e)}"
         )
 
+# Pre-encoded so load balancer probes skip serialization entirely
+HEALTH_RESPONSE_BODY = b'{"status":"healthy"}'
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    return Response(HEALTH_RESPONSE_BODY, media_type="application/json")
 
 @app.get("/")
 async def root():
@@ -209,7 +328,8 @@ async def root():
 @app.post("/auth/register", response_model=Dict)
 async def register(user_data: UserCreate):
     """Register a new user"""
-    result = register_new_user(user_data)
+    # Password hashing is deliberately slow; keep it off the event loop
+    result = await asyncio.to_thread(register_new_user, user_data)
     if not result["success"]:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -220,7 +340,8 @@ async def register(user_data: UserCreate):
 @app.post("/auth/token", response_model=Token)
 async def login(user_data: UserLogin):
     """Login and get access token"""
-    result = login_user(user_data)
+    # Password verification is deliberately slow; keep it off the event loop
+    result = await asyncio.to_thread(login_user, user_data)
     if not result["success"]:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -232,36 +353,61 @@ async def login(user_data: UserLogin):
         "token_type": result["token_type"]
     }
 
+def json_scan_count(value):
+    """A scan limit or count as JSON can carry it: JSON has no infinity, so
+    an unlimited one goes out as null"""
+    return None if value == math.inf else value
+
+def subscription_response(subscription: Dict) -> Dict:
+    """A subscription status as the API returns it"""
+    return {
+        **subscription,
+        "scan_limit": json_scan_count(subscription["scan_limit"]),
+        "scans_remaining": json_scan_count(subscription["scans_remaining"])
+    }
+
 @app.get("/auth/me", response_model=Dict)
 async def get_user_info(current_user: Dict = Depends(get_current_user)):
     """Get current user information"""
     # Get subscription status
-    subscription = check_user_subscription_status(current_user["id"])
+    subscription = await asyncio.to_thread(check_user_subscription_status, current_user["id"])
     
     return {
         "user_id": current_user["id"],
         "email": current_user["email"],
         "created_at": current_user["created_at"],
-        "subscription": subscription
+        "subscription": subscription_response(subscription)
     }
 
 # Payment and subscription endpoints
-@app.get("/subscription/plans", response_model=Dict)
+
+# PLANS never changes at runtime, so it's serialized once at import.
+# allow_nan=False makes any non-finite value json_scan_count doesn't handle
+# fail here, at import, rather than in the clients parsing it.
+PLANS_RESPONSE_BODY = json.dumps(
+    {"plans": {
+        plan_type: {**plan, "scan_limit": json_scan_count(plan["scan_limit"])}
+        for plan_type, plan in PLANS.items()
+    }},
+    allow_nan=False
+).encode()
+
+@app.get("/subscription/plans")
 async def get_subscription_plans():
     """Get available subscription plans"""
-    return {"plans": PLANS}
+    return Response(PLANS_RESPONSE_BODY, media_type="application/json")
 
 @app.get("/subscription/status", response_model=Dict)
-async def get_subscription_status(current_user: Dict = Depends(get_current_user)):
+async def get_subscription_status(current_user: Dict = Depends(get_current_user_light)):
     """Get user's subscription status"""
-    status = check_user_subscription_status(current_user["id"])
-    return {"subscription": status}
+    status = await asyncio.to_thread(check_user_subscription_status, current_user["id"])
+    return {"subscription": subscription_response(status)}
 
 @app.post("/subscription/checkout", response_model=Dict)
-async def create_subscription_checkout(request: Dict, current_user: Dict = Depends(get_current_user)):
+async def create_subscription_checkout(request: Dict, current_user: Dict = Depends(get_current_user_light)):
     """Create a checkout session for subscription"""
     # Create or get Stripe customer
-    customer_result = create_customer(current_user["email"])
+    customer_result = await asyncio.to_thread(create_customer, current_user["email"])
     if not customer_result["success"]:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -269,11 +415,13 @@ async def create_subscription_checkout(request: Dict, current_user: Dict = Depen
         )
     
     # Create checkout session
-    checkout_result = create_checkout_session(
+    checkout_result = await asyncio.to_thread(
+        create_checkout_session,
         customer_id=customer_result["customer_id"],
         price_id=request["price_id"],
         success_url=request["success_url"],
-        cancel_url=request["cancel_url"]
+        cancel_url=request["cancel_url"],
+        user_id=current_user["id"]
     )
     
     if not checkout_result["success"]:
@@ -285,10 +433,10 @@ async def create_subscription_checkout(request: Dict, current_user: Dict = Depen
     return {"session_id": checkout_result["session_id"], "checkout_url": checkout_result["checkout_url"]}
 
 @app.post("/subscription/cancel", response_model=Dict)
-async def cancel_user_subscription(current_user: Dict = Depends(get_current_user)):
+async def cancel_user_subscription(current_user: Dict = Depends(get_current_user_light)):
     """Cancel user's subscription"""
     # Get user's subscription
-    subscription = check_user_subscription_status(current_user["id"])
+    subscription = await asyncio.to_thread(check_user_subscription_status, current_user["id"])
     
     if subscription["plan"] == "free" or subscription["status"] != "active":
         return {"message": "No active subscription to cancel"}
@@ -310,7 +458,7 @@ async def stripe_webhook(request: Request):
             detail="Missing Stripe signature"
         )
     
-    result = handle_webhook_event(payload, sig_header)
+    result = verify_webhook_event(payload, sig_header)
     
     if not result["success"]:
         raise HTTPException(
@@ -318,14 +466,24 @@ async def stripe_webhook(request: Request):
             detail=result.get("error", "Invalid webhook event")
         )
     
+    # Apply the event before acknowledging it. Applying is only local DB
+    # writes, and an error response makes Stripe redeliver the event instead
+    # of it being lost with a failed or interrupted background task.
+    handled = await asyncio.to_thread(handle_webhook_event, result["event"])
+    if not handled["success"]:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Could not apply webhook event"
+        )
+    
     return {"status": "success"}
 
 # Scan history endpoints
 @app.get("/scan/history", response_model=Dict)
-async def get_scan_history(current_user: Dict = Depends(get_current_user)):
+async def get_scan_history(current_user: Dict = Depends(get_current_user_light)):
     """Get user's scan history"""
     history = get_user_scan_history(current_user["id"])
-    return {"history": history}
+    return {"history": [dict(row) for row in history]}
 
 # MVP endpoints
 @app.post("/phishing/analyze")
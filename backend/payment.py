@@ -1,15 +1,25 @@
 # Payment module for PhishGuard using Stripe
 import os
+import json
+import hmac
+import math
+import time
+import hashlib
+import threading
+import orjson
+import redis
 import stripe
-from datetime import datetime
+from cachetools import TTLCache
+from types import MappingProxyType
 from typing import Dict, Optional, Any
 from dotenv import load_dotenv
 from shared.logger import logger
 
 # Import database functions
 from backend.database import (
-    get_user_by_id, get_user_subscription,
-    create_subscription, update_subscription
+    create_subscription_if_missing, update_subscription_status_by_stripe_id,
+    get_user_plan_usage, get_user_by_email,
+    mark_stripe_event_processed, record_latest_stripe_event, transaction
 )
 
 # Load environment variables
@@ -18,6 +28,8 @@ load_dotenv()
 # Configure Stripe
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+# Oldest webhook signature timestamp we accept, in seconds (Stripe's default)
+WEBHOOK_TOLERANCE = 300
 
 # Subscription plans with Stripe price IDs
 PLANS = {
@@ -31,7 +43,7 @@ PLANS = {
     "pro": {
         "name": "Pro Tier",
         "price": 9,  # $9 per month
-        "scan_limit": float('inf'),  # Unlimited scans
+        "scan_limit": math.inf,  # Unlimited scans
         "stripe_price_id": "price_H5ggYwtDq9DGrp",  # Replace with your actual Stripe price ID
         "features": [
             "Advanced phishing detection", 
@@ -43,6 +55,114 @@ PLANS = {
     }
 }
 
+# (scan_limit, features) for each plan, resolved once since PLANS never
+# changes at runtime
+PLAN_META = MappingProxyType({
+    plan_type: (plan["scan_limit"], plan["features"])
+    for plan_type, plan in PLANS.items()
+})
+
+# Per-user subscription status, read on every scan. Scans are counted on
+# top of the cached entry and subscription changes drop it. With REDIS_URL
+# set the cache lives in Redis and is shared by every worker; otherwise each
+# process keeps its own short-lived copy.
+REDIS_URL = os.getenv("REDIS_URL")
+SUBSCRIPTION_CACHE_TTL = 300 if REDIS_URL else 60
+# Seconds a Redis call may take before we give up and use the database, so
+# a slow or unreachable Redis can't stall the requests waiting on it
+REDIS_TIMEOUT = 0.1
+redis_client = redis.Redis.from_url(
+    REDIS_URL, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT
+) if REDIS_URL else None
+
+_status_cache_lock = threading.Lock()
+_status_cache = TTLCache(maxsize=10_000, ttl=SUBSCRIPTION_CACHE_TTL)
+
+def _sub_cache_key(user_id: int) -> str:
+    return f"user_sub:{user_id}"
+
+def _with_scans(subscription_status: Dict, scans: int) -> Dict:
+    """A subscription status with `scans` more scans counted against it"""
+    return {
+        **subscription_status,
+        "scans_used": subscription_status["scans_used"] + scans,
+        "scans_remaining": max(0, subscription_status["scans_remaining"] - scans)
+    }
+
+# In Redis each user's entry is a hash: "status" holds the JSON status as
+# read from the database and "scans" counts the scans recorded since. Scans
+# bump the counter with HINCRBY, which is atomic across workers and leaves
+# the entry's TTL alone, so it still expires and gets rebuilt on schedule.
+
+def _sub_cache_get(user_id: int) -> Optional[Dict]:
+    """Get a user's cached subscription status, if any"""
+    if redis_client is None:
+        with _status_cache_lock:
+            return _status_cache.get(user_id)
+    try:
+        cached = redis_client.hgetall(_sub_cache_key(user_id))
+    except redis.RedisError as e:
+        logger.error(f"Error reading subscription cache: {str(e)}")
+        return None
+    if b"status" not in cached:
+        return None
+    return _with_scans(json.loads(cached[b"status"]), int(cached.get(b"scans", 0)))
+
+def _sub_cache_set(user_id: int, subscription_status: Dict) -> None:
+    """Cache a user's subscription status"""
+    if redis_client is None:
+        with _status_cache_lock:
+            _status_cache[user_id] = subscription_status
+        return
+    key = _sub_cache_key(user_id)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, "status", json.dumps(subscription_status))
+        pipe.expire(key, SUBSCRIPTION_CACHE_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Error writing subscription cache: {str(e)}")
+
+def invalidate_subscription_status(user_id: int) -> None:
+    """Drop a user's cached subscription status"""
+    if redis_client is None:
+        with _status_cache_lock:
+            _status_cache.pop(user_id, None)
+        return
+    try:
+        redis_client.delete(_sub_cache_key(user_id))
+    except redis.RedisError as e:
+        logger.error(f"Error invalidating subscription cache: {str(e)}")
+
+def record_scan_usage(user_id: int) -> None:
+    """Count one more scan against a user's cached subscription status"""
+    if redis_client is None:
+        with _status_cache_lock:
+            cached = _status_cache.get(user_id)
+            if cached is not None:
+                _status_cache[user_id] = _with_scans(cached, 1)
+        return
+    key = _sub_cache_key(user_id)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.hincrby(key, "scans", 1)
+        pipe.ttl(key)
+        _, ttl = pipe.execute()
+        # No TTL means the entry expired in between and HINCRBY just
+        # recreated it as a bare counter; don't let that live forever
+        if ttl == -1:
+            redis_client.expire(key, SUBSCRIPTION_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.error(f"Error counting scan in subscription cache: {str(e)}")
+
+# Webhook events that describe a subscription's current state, where only
+# the newest one per subscription matters
+SUBSCRIPTION_EVENT_TYPES = frozenset({
+    "customer.subscription.updated",
+    "customer.subscription.deleted"
+})
+
 # Stripe API functions
 def create_customer(email: str, name: str = None) -> Dict:
     """Create a new customer in Stripe"""
@@ -62,7 +182,8 @@ def create_customer(email: str, name: str = None) -> Dict:
             "error": str(e)
         }
 
-def create_checkout_session(customer_id: str, price_id: str, success_url: str, cancel_url: str) -> Dict:
+def create_checkout_session(customer_id: str, price_id: str, success_url: str, cancel_url: str,
+                            user_id: Optional[int] = None) -> Dict:
     """Create a Stripe checkout session for subscription"""
     try:
         checkout_session = stripe.checkout.Session.create(
@@ -75,6 +196,10 @@ def create_checkout_session(customer_id: str, price_id: str, success_url: str, c
             mode="subscription",
             success_url=success_url,
             cancel_url=cancel_url,
+            client_reference_id=str(user_id) if user_id is not None else None,
+            # Carried on the subscription itself, so its created event has
+            # everything we need without fetching it back from Stripe
+            subscription_data={"metadata": {"user_id": user_id}} if user_id is not None else None,
         )
         return {
             "success": True,
@@ -106,116 +231,242 @@ def cancel_subscription(subscription_id: str) -> Dict:
             "error": str(e)
         }
 
-def handle_webhook_event(payload: bytes, signature: str) -> Dict:
-    """Handle Stripe webhook events"""
+def _verify_webhook_signature(payload: bytes, signature: str) -> None:
+    """Check a Stripe-Signature header against the raw request body.
+    
+    Same checks as stripe.WebhookSignature.verify_header, but the body is
+    fed to the HMAC as the bytes we received instead of being decoded to
+    str and encoded back first.
+    """
+    timestamp = None
+    signatures = []
+    for item in signature.split(","):
+        key, _, value = item.partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+    
+    if not timestamp or not signatures:
+        raise ValueError("Unable to extract timestamp and signatures from header")
+    
+    mac = hmac.new(STRIPE_WEBHOOK_SECRET.encode(), timestamp.encode() + b".", hashlib.sha256)
+    mac.update(payload)
+    expected = mac.hexdigest()
+    if not any(hmac.compare_digest(expected, sig) for sig in signatures):
+        raise ValueError("No signatures found matching the expected signature for payload")
+    
+    if int(timestamp) < time.time() - WEBHOOK_TOLERANCE:
+        raise ValueError("Timestamp outside the tolerance zone")
+
+def verify_webhook_event(payload: bytes, signature: str) -> Dict:
+    """Check a Stripe webhook's signature and parse its event.
+    
+    The event is then applied by handle_webhook_event.
+    """
     try:
-        event = stripe.Webhook.construct_event(
-            payload, signature, STRIPE_WEBHOOK_SECRET
-        )
-        
-        # Handle the event based on its type
-        if event.type == "checkout.session.completed":
-            # Payment was successful, activate the subscription
-            session = event.data.object
-            handle_successful_payment(session)
-        
-        elif event.type == "customer.subscription.updated":
-            # Subscription was updated
-            subscription = event.data.object
-            handle_subscription_updated(subscription)
+        _verify_webhook_signature(payload, signature)
+        event = stripe.Event.construct_from(orjson.loads(payload), stripe.api_key)
+        return {"success": True, "event": event}
+    except Exception as e:
+        logger.error(f"Error verifying webhook: {str(e)}")
+        return {"success": False, "error": str(e)}
+
+def handle_webhook_event(event: stripe.Event) -> Dict:
+    """Apply a verified Stripe webhook event"""
+    try:
+        # Stripe retries deliveries, so mark the event and apply its changes
+        # in one transaction. If applying it fails, the mark rolls back too
+        # and a redelivery gets another try.
+        with transaction():
+            if not mark_stripe_event_processed(event.id, event.type):
+                logger.info(f"Skipping already processed Stripe event {event.id}")
+                return {"success": True, "duplicate": True}
+            
+            # Subscription events arrive in bursts and out of order; only
+            # apply one if it's newer than the last of its kind we handled
+            if event.type in SUBSCRIPTION_EVENT_TYPES and not record_latest_stripe_event(
+                event.data.object.id, event.type, event.created
+            ):
+                logger.info(f"Skipping stale Stripe event {event.id}")
+                return {"success": True, "duplicate": True}
+            
+            # Handle the event based on its type
+            user_id = None
+            if event.type == "checkout.session.completed":
+                # Payment was successful, activate the subscription
+                session = event.data.object
+                user_id = handle_successful_payment(session)
+            
+            elif event.type == "customer.subscription.created":
+                # Subscription was created, possibly still awaiting payment
+                subscription = event.data.object
+                user_id = handle_subscription_created(subscription)
+            
+            elif event.type == "customer.subscription.updated":
+                # Subscription was updated
+                subscription = event.data.object
+                user_id = handle_subscription_updated(subscription)
+            
+            elif event.type == "customer.subscription.deleted":
+                # Subscription was canceled or expired
+                subscription = event.data.object
+                user_id = handle_subscription_canceled(subscription)
         
-        elif event.type == "customer.subscription.deleted":
-            # Subscription was canceled or expired
-            subscription = event.data.object
-            handle_subscription_canceled(subscription)
+        # Only drop the cached status once the change is committed; before
+        # that, a concurrent lookup could cache the old row all over again
+        if user_id is not None:
+            invalidate_subscription_status(user_id)
         
         return {"success": True}
     
     except Exception as e:
         logger.error(f"Error handling webhook: {str(e)}")
-        # TODO: Optionally notify admin or retry event
         return {"success": False, "error": str(e)}
 
-# Webhook event handlers
-def handle_successful_payment(session: Dict) -> None:
-    """Handle successful payment and activate subscription"""
+# Webhook event handlers. Each returns the ID of the user whose subscription
+# changed (None if nothing did) and lets database errors propagate, so
+# handle_webhook_event can roll the whole event back.
+def _metadata_user_id(subscription: Dict) -> Optional[int]:
+    """The user ID stored in a subscription's metadata at checkout, if any.
+    
+    Subscriptions from checkouts started before it was stored there have none.
+    """
+    user_id = (subscription.get("metadata") or {}).get("user_id")
+    return int(user_id) if user_id else None
+
+def handle_successful_payment(session: Dict) -> Optional[int]:
+    """Handle successful payment and activate subscription.
+    
+    Works for every checkout, including ones whose subscription carries no
+    user ID: the session itself names the user, or at least their email.
+    """
     # Extract customer and subscription IDs
     customer_id = session.get("customer")
     subscription_id = session.get("subscription")
     
     if not customer_id or not subscription_id:
         logger.error("Missing customer or subscription ID in session")
-        return
+        return None
     
-    # Get subscription details from Stripe
-    try:
-        subscription = stripe.Subscription.retrieve(subscription_id)
-        
-        # Get the user ID from metadata or lookup by customer ID
-        # This would require storing the user_id in the checkout session metadata
-        user_id = session.get("client_reference_id")
-        
-        if not user_id:
-            logger.error("Missing user ID in session metadata")
-            return
-        
-        # Create subscription record in database
-        create_subscription(
-            user_id=int(user_id),
-            stripe_customer_id=customer_id,
-            stripe_subscription_id=subscription_id,
-            plan_type="pro",  # Assuming Pro plan for now
-            status=subscription.status,
-            period_start=datetime.fromtimestamp(subscription.current_period_start),
-            period_end=datetime.fromtimestamp(subscription.current_period_end)
-        )
-        
-        logger.info(f"Subscription activated for user {user_id}")
+    user_id = session.get("client_reference_id")
+    if not user_id:
+        email = (session.get("customer_details") or {}).get("email")
+        user = get_user_by_email(email) if email else None
+        user_id = user["id"] if user else None
     
-    except Exception as e:
-        logger.error(f"Error activating subscription: {str(e)}")
+    if not user_id:
+        logger.error("Missing user ID in session")
+        return None
+    
+    # The session doesn't carry the subscription's own status or period; a
+    # paid session means it's active, and later subscription events keep it
+    # up to date
+    created = create_subscription_if_missing(
+        user_id=int(user_id),
+        stripe_customer_id=customer_id,
+        stripe_subscription_id=subscription_id,
+        plan_type="pro",  # Assuming Pro plan for now
+        status="active" if session.get("payment_status") == "paid" else "incomplete",
+        period_start=None,
+        period_end=None
+    )
+    if not created:
+        return None
+    
+    logger.info(f"Subscription activated for user {user_id}")
+    return int(user_id)
+
+def handle_subscription_created(subscription: Dict) -> Optional[int]:
+    """Store a new subscription as Stripe reports it"""
+    customer_id = subscription.get("customer")
+    subscription_id = subscription.get("id")
+    
+    if not customer_id or not subscription_id:
+        logger.error("Missing customer or subscription ID in subscription")
+        return None
+    
+    user_id = _metadata_user_id(subscription)
+    if user_id is None:
+        # checkout.session.completed will link it to the user instead
+        logger.info(f"No user ID in metadata of subscription {subscription_id}")
+        return None
+    
+    # The created event carries the full subscription, so there's no need
+    # to retrieve it from Stripe again. Its status may still be "incomplete"
+    # (e.g. awaiting 3D Secure); the updated event that follows activates it.
+    created = create_subscription_if_missing(
+        user_id=user_id,
+        stripe_customer_id=customer_id,
+        stripe_subscription_id=subscription_id,
+        plan_type="pro",  # Assuming Pro plan for now
+        status=subscription.status,
+        period_start=subscription.get("current_period_start"),
+        period_end=subscription.get("current_period_end")
+    )
+    if not created:
+        return None
+    
+    logger.info(f"Subscription {subscription_id} created for user {user_id}")
+    return user_id
 
-def handle_subscription_updated(subscription: Dict) -> None:
+def handle_subscription_updated(subscription: Dict) -> Optional[int]:
     """Handle subscription update events"""
     subscription_id = subscription.get("id")
     status = subscription.get("status")
     
     if not subscription_id or not status:
         logger.error("Missing subscription ID or status")
-        return
+        return None
+    
     # Update subscription in database by Stripe ID
-    try:
-        update_subscription(
+    user_id = update_subscription_status_by_stripe_id(subscription_id, status)
+    if user_id is None:
+        # Overtook the event that creates it; store it now if we know whose it is
+        user_id = _metadata_user_id(subscription)
+        if user_id is None:
+            logger.error(f"No stored subscription with Stripe ID {subscription_id}")
+            return None
+        create_subscription_if_missing(
+            user_id=user_id,
+            stripe_customer_id=subscription.get("customer"),
             stripe_subscription_id=subscription_id,
-            status=status
+            plan_type="pro",  # Assuming Pro plan for now
+            status=status,
+            period_start=subscription.get("current_period_start"),
+            period_end=subscription.get("current_period_end")
         )
-        logger.info(f"Subscription {subscription_id} updated to status {status}")
-    except Exception as e:
-        logger.error(f"Error updating subscription in DB: {str(e)}")
+    
+    logger.info(f"Subscription {subscription_id} updated to status {status}")
+    return user_id
 
-def handle_subscription_canceled(subscription: Dict) -> None:
+def handle_subscription_canceled(subscription: Dict) -> Optional[int]:
     """Handle subscription cancellation events"""
     subscription_id = subscription.get("id")
     
     if not subscription_id:
         logger.error("Missing subscription ID")
-        return
+        return None
+    
     # Update subscription in database by Stripe ID
-    try:
-        update_subscription(
-            stripe_subscription_id=subscription_id,
-            status="canceled"
-        )
-        logger.info(f"Subscription {subscription_id} canceled")
-    except Exception as e:
-        logger.error(f"Error updating subscription in DB: {str(e)}")
+    user_id = update_subscription_status_by_stripe_id(subscription_id, "canceled")
+    if user_id is None:
+        logger.error(f"No stored subscription with Stripe ID {subscription_id}")
+        return None
+    
+    logger.info(f"Subscription {subscription_id} canceled")
+    return user_id
 
 # User subscription functions
 def check_user_subscription_status(user_id: int) -> Dict:
     """Check a user's subscription status"""
-    # Get user from database
-    user = get_user_by_id(user_id)
-    if not user:
+    cached = _sub_cache_get(user_id)
+    if cached is not None:
+        return cached
+    
+    # Get the user's scan count and latest subscription in one query
+    usage = get_user_plan_usage(user_id)
+    if not usage:
         return {
             "plan": "none",
             "status": "inactive",
@@ -224,41 +475,44 @@ def check_user_subscription_status(user_id: int) -> Dict:
             "scans_remaining": 0
         }
     
-    # Get subscription from database
-    subscription = get_user_subscription(user_id)
-    
     # Default to free tier if no subscription
-    if not subscription or subscription["status"] != "active":
+    if usage["status"] != "active":
         plan_type = "free"
         status = "active"
     else:
-        plan_type = subscription["plan_type"]
-        status = subscription["status"]
+        plan_type = usage["plan_type"]
+        status = usage["status"]
     
     # Get plan details
-    plan = PLANS.get(plan_type, PLANS["free"])
+    scan_limit, features = PLAN_META.get(plan_type, PLAN_META["free"])
     
     # Get scan count
-    scans_used = user["scan_count"]
+    scans_used = usage["scan_count"]
     
     # Calculate scans remaining
-    if plan_type == "pro":
-        scans_remaining = float('inf')
+    if scan_limit == math.inf:
+        scans_remaining = math.inf
     else:
-        scans_remaining = max(0, plan["scan_limit"] - scans_used)
+        scans_remaining = max(0, scan_limit - scans_used)
     
-    return {
+    result = {
         "plan": plan_type,
         "status": status,
-        "scan_limit": plan["scan_limit"],
+        "scan_limit": scan_limit,
         "scans_used": scans_used,
         "scans_remaining": scans_remaining,
-        "features": plan["features"]
+        "features": features
     }
+    _sub_cache_set(user_id, result)
+    return result
 
 def can_user_perform_scan(user_id: int) -> bool:
     """Check if a user can perform a scan based on their subscription"""
     subscription_status = check_user_subscription_status(user_id)
     
-    # If user has remaining scans or is on pro plan, they can scan
-    return subscription_status["scans_remaining"] > 0 or subscription_status["plan"] == "pro"
\ No newline at end of file
+    # Unlimited plans can always scan, whatever their scan count says
+    if subscription_status["scan_limit"] == math.inf:
+        return True
+    
+    # Otherwise the user needs scans left this period
+    return subscription_status["scans_remaining"] > 0
\ No newline at end of file
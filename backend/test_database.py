@@ -0,0 +1,45 @@
+"""
+Scan writer tests for PhishGuard
+"""
+import asyncio
+
+from backend import database
+
+
+def queue_and_stop(user_id, count):
+    """Queue scans through the background writer, shut it down, and return
+    the user's scan count as soon as shutdown returns"""
+    async def run():
+        database.start_scan_writer()
+        for i in range(count):
+            await database.queue_scan(user_id, f"Subject {i}", False, 0.1)
+        # Let the writer pick up its first batch before shutting down
+        await asyncio.sleep(0)
+        await database.stop_scan_writer()
+        return database.get_user_scan_count(user_id)
+    return asyncio.run(run())
+
+
+def test_stop_scan_writer_writes_every_queued_scan(db):
+    user_id = database.create_user("user@example.com", "hash")
+
+    # More than one batch, so shutdown lands while the writer is mid-way
+    count = database.SCAN_BATCH_SIZE * 2 + 10
+
+    assert queue_and_stop(user_id, count) == count
+
+
+def test_failed_scan_batch_is_retried(db, monkeypatch):
+    user_id = database.create_user("user@example.com", "hash")
+    record_scans = database.record_scans
+    attempts = []
+
+    def flaky_record_scans(scans):
+        attempts.append(len(scans))
+        return len(attempts) > 1 and record_scans(scans)
+
+    monkeypatch.setattr(database, "record_scans", flaky_record_scans)
+    monkeypatch.setattr(database, "SCAN_WRITE_RETRY_DELAY", 0)
+
+    assert queue_and_stop(user_id, 3) == 3
+    assert len(attempts) == 2
@@ -0,0 +1,128 @@
+"""
+Stripe webhook tests for PhishGuard
+"""
+import sqlite3
+
+import stripe
+
+from backend import database, payment
+from backend.payment import handle_webhook_event, check_user_subscription_status
+
+
+def stripe_event(event_id, event_type, created, data_object):
+    """A verified-looking Stripe event"""
+    return stripe.Event.construct_from({
+        "id": event_id,
+        "object": "event",
+        "type": event_type,
+        "created": created,
+        "data": {"object": data_object}
+    }, "sk_test")
+
+
+def subscription_event(event_id, event_type, created, status, metadata=None):
+    """A Stripe event for subscription sub_123"""
+    return stripe_event(event_id, event_type, created, {
+        "id": "sub_123",
+        "object": "subscription",
+        "customer": "cus_123",
+        "status": status,
+        "metadata": metadata or {}
+    })
+
+
+def test_subscription_updated_and_deleted_events(db):
+    user_id = database.create_user("user@example.com", "hash")
+    database.create_subscription(
+        user_id, "cus_123", "sub_123", "pro", "incomplete", 1700000000, 1702592000
+    )
+    # Cache the pre-webhook status, which the events must invalidate
+    assert check_user_subscription_status(user_id)["plan"] == "free"
+
+    result = handle_webhook_event(
+        subscription_event("evt_1", "customer.subscription.updated", 1700000100, "active")
+    )
+    assert result == {"success": True}
+    assert database.get_user_subscription(user_id)["status"] == "active"
+    assert check_user_subscription_status(user_id)["plan"] == "pro"
+
+    result = handle_webhook_event(
+        subscription_event("evt_2", "customer.subscription.deleted", 1700000200, "canceled")
+    )
+    assert result == {"success": True}
+    assert database.get_user_subscription(user_id)["status"] == "canceled"
+    assert check_user_subscription_status(user_id)["plan"] == "free"
+
+
+def test_failed_event_is_applied_on_redelivery(db, monkeypatch):
+    user_id = database.create_user("user@example.com", "hash")
+    database.create_subscription(
+        user_id, "cus_123", "sub_123", "pro", "incomplete", 1700000000, 1702592000
+    )
+    event = subscription_event("evt_1", "customer.subscription.updated", 1700000100, "active")
+
+    def fail(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    with monkeypatch.context() as m:
+        m.setattr(payment, "update_subscription_status_by_stripe_id", fail)
+        assert handle_webhook_event(event)["success"] is False
+
+    # The failure rolled back the processed mark, so Stripe's retry applies it
+    assert handle_webhook_event(event) == {"success": True}
+    assert database.get_user_subscription(user_id)["status"] == "active"
+
+
+def test_incomplete_subscription_activates_on_update(db):
+    user_id = database.create_user("user@example.com", "hash")
+    metadata = {"user_id": str(user_id)}
+
+    # e.g. a card that still needs 3D Secure
+    handle_webhook_event(
+        subscription_event("evt_1", "customer.subscription.created", 1700000000, "incomplete", metadata)
+    )
+    assert check_user_subscription_status(user_id)["plan"] == "free"
+
+    handle_webhook_event(
+        subscription_event("evt_2", "customer.subscription.updated", 1700000100, "active", metadata)
+    )
+    assert check_user_subscription_status(user_id)["plan"] == "pro"
+
+
+def test_checkout_session_activates_subscription_without_metadata(db):
+    user_id = database.create_user("user@example.com", "hash")
+
+    # Checkouts started before the user ID went into subscription metadata
+    handle_webhook_event(
+        subscription_event("evt_1", "customer.subscription.created", 1700000000, "active")
+    )
+    assert database.get_user_subscription(user_id) is None
+
+    handle_webhook_event(stripe_event("evt_2", "checkout.session.completed", 1700000001, {
+        "id": "cs_123",
+        "object": "checkout.session",
+        "customer": "cus_123",
+        "subscription": "sub_123",
+        "client_reference_id": None,
+        "customer_details": {"email": "user@example.com"},
+        "payment_status": "paid"
+    }))
+    assert check_user_subscription_status(user_id)["plan"] == "pro"
+
+    # Later status changes find the row the session created
+    handle_webhook_event(
+        subscription_event("evt_3", "customer.subscription.deleted", 1700000200, "canceled")
+    )
+    assert check_user_subscription_status(user_id)["plan"] == "free"
+
+
+def test_recorded_scans_count_against_cached_status(db):
+    user_id = database.create_user("user@example.com", "hash")
+    assert check_user_subscription_status(user_id)["scans_remaining"] == 5
+
+    for _ in range(2):
+        payment.record_scan_usage(user_id)
+
+    subscription = check_user_subscription_status(user_id)
+    assert subscription["scans_used"] == 2
+    assert subscription["scans_remaining"] == 3
@@ -0,0 +1,29 @@
+import os
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# API endpoint, shared by every page including the dashboard
+API_URL = os.getenv("PHISHGUARD_BACKEND_URL", "https://phishguard-mcuv.onrender.com")
+
+# (connect, read) timeouts in seconds; analysis can take a while on the server
+API_TIMEOUT = (3.05, 30)
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Shared keep-alive session, so API calls reuse an open TLS connection.
+
+    Cached as a resource because Streamlit re-executes the app script on every
+    rerun, which would otherwise build a fresh session (and handshake) each time.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    )
+    # Plain http too, for a backend pointed at localhost
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
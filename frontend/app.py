@@ -4,12 +4,14 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import streamlit as st
 import requests
+import orjson
 import json
+from bisect import bisect_left
 from datetime import datetime
 
 # Import our custom modules
-from frontend.auth import display_login_page, display_user_profile
-from frontend.subscription import display_subscription_page
+from frontend.api import API_URL, API_TIMEOUT, get_http_session
+from frontend.auth import count_scan_in_session
 from frontend.themes.theme_selector import display_theme_selector, apply_selected_theme, initialize_theme_selector
 
 # Configure the page
@@ -28,139 +30,47 @@ apply_selected_theme()
 display_theme_selector()
 
 # --- Million Dollar SaaS UI Polish ---
-st.markdown(
-    '''
-    <style>
-        body {
-            background: linear-gradient(135deg, #232946 0%, #16161a 100%) !important;
-        }
-        .main > div {
-            padding: 2.5rem 2rem;
-            border-radius: 18px;
-            background: rgba(34, 39, 57, 0.92);
-            box-shadow: 0 8px 32px rgba(44, 62, 80, 0.13);
-            max-width: 700px;
-            margin: 2rem auto;
-            border: 1.5px solid #393e5c;
-        }
-        .phishguard-header {
-            display: flex;
-            align-items: center;
-            gap: 1.25rem;
-            margin-bottom: 2rem;
-        }
-        .phishguard-logo {
-            width: 56px;
-            border-radius: 12px;
-            box-shadow: 0 2px 8px rgba(44, 62, 80, 0.18);
-        }
-        h1, h2, h3, .stMarkdown h1, .stMarkdown h2 {
-            font-family: 'Inter', 'Quicksand', sans-serif !important;
-            color: #fafaff;
-            letter-spacing: -0.5px;
-        }
-        .stTextInput input, .stTextArea textarea {
-            background: #232946;
-            border-radius: 8px;
-            border: 1.5px solid #5a5f7a;
-            font-size: 1.1rem;
-            padding: 0.75rem;
-            color: #fafaff;
-        }
-        .stTextInput input::placeholder, .stTextArea textarea::placeholder {
-            color: #a8a8b3;
-            opacity: 1;
-        }
-        .stButton>button {
-            width: 100%;
-            padding: 0.75rem;
-            border-radius: 8px;
-            background: linear-gradient(90deg, #7f5af0 0%, #2cb67d 100%);
-            color: white;
-            font-weight: 600;
-            font-size: 1.1rem;
-            box-shadow: 0 2px 8px rgba(44, 62, 80, 0.20);
-            transition: background 0.2s;
-            border: none;
-        }
-        .stButton>button:hover {
-            background: linear-gradient(90deg, #2cb67d 0%, #7f5af0 100%);
-        }
-        .phishguard-risk-card {
-            background: linear-gradient(90deg, #232946 0%, #393e5c 100%);
-            padding: 28px 24px;
-            border-radius: 16px;
-            box-shadow: 0 4px 16px #232946;
-            margin-bottom: 28px;
-            border: 1.5px solid #393e5c;
-        }
-        .risk-high {
-            color: #ff3864;
-            font-weight: bold;
-            font-size: 1.15rem;
-        }
-        .risk-low {
-            color: #2cb67d;
-            font-weight: bold;
-            font-size: 1.15rem;
-        }
-        .stMetric {
-            background: #16161a;
-            border-radius: 10px;
-            padding: 1rem;
-            margin: 0.5rem 0;
-            color: #fafaff;
-        }
-        .stExpanderHeader {
-            font-size: 1.1rem;
-            font-weight: 600;
-            color: #7f5af0;
-        }
-        .stAlert, .stSuccess, .stError {
-            border-radius: 10px;
-        }
-        /* Animated Gradient Border */
-        .main > div {
-            position: relative;
-            overflow: hidden;
-        }
-        .main > div:before {
-            content: '';
-            position: absolute;
-            top: -4px; left: -4px; right: -4px; bottom: -4px;
-            z-index: 0;
-            background: conic-gradient(from 90deg, #7f5af0, #2cb67d, #7f5af0, #232946);
-            filter: blur(12px);
-            opacity: 0.45;
-            border-radius: 22px;
-            animation: borderSpin 7s linear infinite;
-        }
-        .main > div > * { position: relative; z-index: 1; }
-        @keyframes borderSpin {
-            0% { filter: blur(14px) hue-rotate(0deg); }
-            100% { filter: blur(14px) hue-rotate(360deg); }
-        }
-        /* Animated logo float */
-        .phishguard-logo {
-            animation: floatLogo 3.5s ease-in-out infinite;
-        }
-        @keyframes floatLogo {
-            0% { transform: translateY(0px); }
-            50% { transform: translateY(-10px); }
-            100% { transform: translateY(0px); }
-        }
-    </style>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600;700&family=Quicksand:wght@400;600;700&display=swap" rel="stylesheet">
-    <script src="https://cdn.lordicon.com/lordicon.js"></script>
-    ''',
-    unsafe_allow_html=True
-)
+# The stylesheet lives in static/phishguard.css and is served by Streamlit
+# (see .streamlit/config.toml), so each rerun only sends these few tags
+# instead of the whole CSS blob. One Google Fonts request covers the app and
+# every theme; browsers only download the faces a page actually uses.
+PAGE_HEAD_TAGS = '''
+<link rel="preconnect" href="https://fonts.googleapis.com">
+<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+<link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&family=Quicksand:wght@400;500;600;700&family=JetBrains+Mono:wght@400;700&display=swap" rel="stylesheet">
+<link rel="stylesheet" href="app/static/phishguard.css">
+<script src="https://cdn.lordicon.com/lordicon.js"></script>
+'''
+st.markdown(PAGE_HEAD_TAGS, unsafe_allow_html=True)
+
+# Sketchy score labels: a confidence above each threshold moves up one label
+RISK_THRESHOLDS = (0.4, 0.7)
+RISK_LABELS = ("Looking good!", "Hmm...", "Yikes!")
 
-# API endpoint
-API_URL = "https://phishguard-mcuv.onrender.com"
+# Prefixes the backend puts on risk factors found by the AI model
+AI_FACTOR_PREFIXES = ("GPT detected",)
 
-def analyze_email(subject: str, body: str, sender: str, token: str = None) -> dict:
-    """Send email content to API for analysis."""
+# Card shown above the detailed results; only the two values change per scan
+RISK_CARD_TEMPLATE = (
+    "<div class='phishguard-risk-card'>"
+    "<h3>Risk Score: {confidence}</h3>"
+    "<p>{summary}</p>"
+    "</div>"
+)
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def fetch_analysis(subject: str, body: str, sender: str, token: str = None, _on_request=None) -> dict:
+    """POST an email to /analyze and return the parsed result.
+    
+    Cached per (subject, body, sender, token), so resubmitting the same email
+    in the same login session skips the round trip and the model. Such a
+    repeat never reaches /analyze, so it doesn't count against the plan's
+    scan limit again; Re-scan does. Errors raise, and Streamlit never
+    caches a call that raised.
+    
+    _on_request (left out of the cache key) is called only when the email
+    really goes to /analyze, so callers can tell a new scan from a cached one.
+    """
     data = {
         "subject": subject,
         "body": body,
@@ -171,20 +81,37 @@ def analyze_email(subject: str, body: str, sender: str, token: str = None) -> di
     if token:
         headers["Authorization"] = f"Bearer {token}"
     
+    response = get_http_session().post(
+        f"{API_URL}/analyze",
+        data=orjson.dumps(data),
+        headers=headers,
+        timeout=API_TIMEOUT
+    )
+    response.raise_for_status()
+    if _on_request:
+        _on_request()
+    return orjson.loads(response.content)
+
+def analyze_email(subject: str, body: str, sender: str, token: str = None) -> tuple:
+    """Send email content to API for analysis.
+    
+    Returns (analysis, scanned), where scanned is False when the result came
+    from the cache and so didn't use up a scan.
+    """
+    scanned = []
     try:
-        response = requests.post(
-            f"{API_URL}/analyze",
-            json=data,
-            headers=headers
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        analysis = fetch_analysis(subject, body, sender, token, _on_request=lambda: scanned.append(True))
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         st.error(f"Error during analysis: {str(e)}")
-        return None
+        return None, False
+    return analysis, bool(scanned)
 
 def display_results(analysis: dict):
     """Show analysis results in a friendly, easy-to-understand way."""
+    # Tally everything the metrics and sections below need up front
+    suspicious_urls = [url for url in analysis['suspicious_urls'] if url['is_suspicious']]
+    gpt_factor_count = sum(1 for factor in analysis['risk_factors'] if factor.startswith(AI_FACTOR_PREFIXES))
+    
     # Give the overall verdict with a friendly tone
     if analysis["is_phishing"]:
         st.error("🚨 Hold up! This looks like a scam email!")
@@ -193,43 +120,26 @@ def display_results(analysis: dict):
         st.success("✅ Good news! This email checks out!")
         st.markdown(f"<p class='risk-low'>{analysis['summary']}</p>", unsafe_allow_html=True)
     
-    # Show key findings in a simple way
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        risk_level = "Yikes!" if analysis['confidence'] > 0.7 else "Hmm..." if analysis['confidence'] > 0.4 else "Looking good!"
-        st.metric(
-            label="Sketchy Score",
-            value=f"{analysis['confidence']:.0%}",
-            delta=risk_level
-        )
-    
-    with col2:
-        suspicious_count = len([url for url in analysis['suspicious_urls'] if url['is_suspicious']])
-        st.metric(
-            label="Fishy Links Found",
-            value=suspicious_count
-        )
-    
-    with col3:
-        # Count how many GPT-detected factors are in the risk factors
-        gpt_factors = [factor for factor in analysis['risk_factors'] if factor.startswith("GPT detected")]
-        st.metric(
-            label="Red Flags Spotted",
-            value=len(analysis['risk_factors']),
-            delta=f"{len(gpt_factors)} from AI" if gpt_factors else None
-        )
+    # Show key findings in a simple way: (label, value, delta) per column
+    risk_level = RISK_LABELS[bisect_left(RISK_THRESHOLDS, analysis['confidence'])]
+    metrics = (
+        ("Sketchy Score", f"{analysis['confidence']:.0%}", risk_level),
+        ("Fishy Links Found", len(suspicious_urls), None),
+        ("Red Flags Spotted", len(analysis['risk_factors']),
+         f"{gpt_factor_count} from AI" if gpt_factor_count else None),
+    )
+    for col, (label, value, delta) in zip(st.columns(len(metrics)), metrics):
+        col.metric(label=label, value=value, delta=delta)
     
     # Break down any suspicious links we found
-    if analysis['suspicious_urls']:
+    if suspicious_urls:
         st.subheader("🔍 Let's Look at Those Links...")
-        for url in analysis['suspicious_urls']:
-            if url['is_suspicious']:
-                with st.expander(f"🚫 Watch out for: {url['domain']}"):
-                    st.markdown("**They want you to click:** " + url['url'])
-                    st.markdown("**Why it's suspicious:**")
-                    for reason in url['reasons']:
-                        st.warning(f"⚠️ {reason}")
+        for url in suspicious_urls:
+            with st.expander(f"🚫 Watch out for: {url['domain']}"):
+                st.markdown("**They want you to click:** " + url['url'])
+                st.markdown("**Why it's suspicious:**")
+                for reason in url['reasons']:
+                    st.warning(f"⚠️ {reason}")
     
     # List out the warning signs we spotted
     if analysis["risk_factors"]:
@@ -258,18 +168,17 @@ def display_results(analysis: dict):
 def display_home_page():
     st.title("🛡️ PhishGuard - Your Email Bodyguard")
     st.markdown("""
-    <div style='display:flex;align-items:center;gap:1rem;margin-bottom:1.5rem;'>
+    <div class='phishguard-hero'>
         <lord-icon
             src="https://cdn.lordicon.com/tdrtiskw.json"
             trigger="loop"
-            colors="primary:#7f5af0,secondary:#2cb67d"
-            style="width:48px;height:48px;">
+            colors="primary:#7f5af0,secondary:#2cb67d">
         </lord-icon>
-        <span style='font-size:2rem;font-family:Inter,Quicksand,sans-serif;font-weight:700;color:#fafaff;'>PhishGuard</span>
+        <span class='phishguard-hero-title'>PhishGuard</span>
     </div>
-    <div style='font-size:1.22rem; color:#a8a8b3; margin-bottom:2.5rem;'>
+    <div class='phishguard-intro'>
         Paste a suspicious email below. PhishGuard will analyze it for <b>phishing risks</b> and highlight any red flags.<br>
-        <span style='color:#2cb67d;'>Your privacy is protected – we never store your emails.</span>
+        <span class='phishguard-privacy'>Your privacy is protected – we never store your emails.</span>
     </div>
     """, unsafe_allow_html=True)
     
@@ -285,22 +194,28 @@ def display_home_page():
             height=220
         )
         submitted = st.form_submit_button("🔍 Analyze Email")
-        if submitted:
+        rescan = st.form_submit_button("🔄 Re-scan", help="Analyze again instead of reusing the last result")
+        token = st.session_state.get("token", None)
+        if rescan:
+            # Drop only this email's cached result, not every session's
+            fetch_analysis.clear(subject, body, sender, token)
+        if submitted or rescan:
             if sender and subject and body:
                 with st.spinner("🕵️‍♂️ Scanning for phishing signals..."):
-                    analysis = analyze_email(subject, body, sender, st.session_state.get("token", None))
+                    analysis, scanned = analyze_email(subject, body, sender, token)
                     if analysis:
                         st.markdown(
-                            f"""
-                            <div class='phishguard-risk-card'>
-                                <h3 style='color:#2cb67d;'>Risk Score: {analysis.get('confidence', 'N/A')}</h3>
-                                <p>{analysis.get('summary', '')}</p>
-                            </div>
-                            """,
+                            RISK_CARD_TEMPLATE.format(
+                                confidence=analysis.get('confidence', 'N/A'),
+                                summary=analysis.get('summary', '')
+                            ),
                             unsafe_allow_html=True
                         )
                         display_results(analysis)
-                        st.balloons()
+                        # Celebrate the first scan only; later ones just get the message
+                        if not st.session_state.get("balloons_shown"):
+                            st.balloons()
+                            st.session_state["balloons_shown"] = True
                         st.success("Analysis complete! Stay safe out there 🚀")
                         st.markdown("""
                         <div style='text-align:center;margin-top:1.5rem;'>
@@ -313,20 +228,21 @@ def display_home_page():
                             <div style='color:#fafaff;font-size:1.18rem;font-weight:600;margin-top:0.5rem;'>No threats found! Your email is safe.</div>
                         </div>
                         """, unsafe_allow_html=True)
-                        st.session_state.pop("user", None)
+                        if scanned:
+                            count_scan_in_session()
             else:
                 st.warning("Please fill in <b>all</b> fields above to analyze the email.", unsafe_allow_html=True)
     
     with st.expander("📚 Quick Tips to Spot Fake Emails"):
         st.markdown("""
-        <div style='font-size:1.08rem;'>
+        <div class='phishguard-tips'>
         <b>🚩 Red Flags:</b><br>
         • Typos, weird grammar, or urgent threats<br>
         • Sender's address looks off (e.g. amaz0n.com)<br>
         • Links asking you to verify info<br>
         • Requests for passwords or payment<br>
         </div>
-        <div style='font-size:1.08rem; margin-top:0.5rem;'>
+        <div class='phishguard-tips'>
         <b>🛡️ Pro Tips:</b><br>
         • Don't click suspicious links<br>
         • Call the company if unsure<br>
@@ -334,6 +250,14 @@ def display_home_page():
         </div>
         """, unsafe_allow_html=True)
 
+def go_to_page(page: str) -> None:
+    """Button callback that switches pages.
+    
+    Callbacks run before the rerun a click triggers, so that single rerun
+    already draws the new page.
+    """
+    st.session_state["page"] = page
+
 def main():
     # Initialize session state for navigation
     if "page" not in st.session_state:
@@ -345,20 +269,23 @@ def main():
         <div class='phishguard-header'>
             <img src='https://raw.githubusercontent.com/vladimirvalcourt/phishguard/main/frontend/dashboard/phishguard-logo.png' class='phishguard-logo' alt='PhishGuard Logo' />
             <div>
-                <h2 style='margin-bottom:0;'>PhishGuard</h2>
-                <span style='font-size:0.9rem;color:#888;'>AI-powered email security</span>
+                <h2>PhishGuard</h2>
+                <span>AI-powered email security</span>
             </div>
         </div>
         """, unsafe_allow_html=True)
         st.divider()
         st.title("Navigation")
-        if st.button("🏠 Home"):
-            st.session_state["page"] = "home"
-            st.experimental_rerun()
+        st.button("🏠 Home", on_click=go_to_page, args=("home",))
 
-    # Display the appropriate page based on navigation state
+    # Display the appropriate page based on navigation state. Pages other
+    # than home are imported when first visited, so a session that never
+    # leaves the home page never loads them.
     if st.session_state["page"] == "home":
         display_home_page()
+    elif st.session_state["page"] == "subscription":
+        from frontend.subscription import display_subscription_page
+        display_subscription_page()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,27 +4,31 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import streamlit as st
 import requests
+import orjson
 import json
+import time
 from datetime import datetime
 from shared.logger import logger
+from frontend.api import API_URL, API_TIMEOUT, get_http_session
 
-# API endpoint
-API_URL = "https://phishguard-mcuv.onrender.com"
+# Seconds a fetched profile is trusted before asking the API again
+USER_INFO_TTL = 30
 
 def register_user(email, password):
     """Register a new user"""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             f"{API_URL}/auth/register",
-            json={"email": email, "password": password},
-            headers={"Content-Type": "application/json"}
+            data=orjson.dumps({"email": email, "password": password}),
+            headers={"Content-Type": "application/json"},
+            timeout=API_TIMEOUT
         )
         
         if response.status_code == 200:
             return {"success": True, "message": "Registration successful! Please log in."}
         else:
-            return {"success": False, "message": response.json().get("detail", "Registration failed")}
-    except requests.exceptions.RequestException as e:
+            return {"success": False, "message": orjson.loads(response.content).get("detail", "Registration failed")}
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         st.error(f"Error: {str(e)}")
         logger.error(f"Auth error: {str(e)}")
         return {"success": False, "message": f"Error: {str(e)}"}
@@ -32,22 +36,23 @@ def register_user(email, password):
 def login_user(email, password):
     """Login a user"""
     try:
-        response = requests.post(
+        response = get_http_session().post(
             f"{API_URL}/auth/token",
-            json={"email": email, "password": password},
-            headers={"Content-Type": "application/json"}
+            data=orjson.dumps({"email": email, "password": password}),
+            headers={"Content-Type": "application/json"},
+            timeout=API_TIMEOUT
         )
         
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             return {
                 "success": True,
                 "token": data["access_token"],
                 "token_type": data["token_type"]
             }
         else:
-            return {"success": False, "message": response.json().get("detail", "Login failed")}
-    except requests.exceptions.RequestException as e:
+            return {"success": False, "message": orjson.loads(response.content).get("detail", "Login failed")}
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         st.error(f"Error: {str(e)}")
         logger.error(f"Auth error: {str(e)}")
         return {"success": False, "message": f"Error: {str(e)}"}
@@ -55,23 +60,61 @@ def login_user(email, password):
 def get_user_info(token):
     """Get user information"""
     try:
-        response = requests.get(
+        response = get_http_session().get(
             f"{API_URL}/auth/me",
             headers={
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {token}"
-            }
+            },
+            timeout=API_TIMEOUT
         )
         
         if response.status_code == 200:
-            return {"success": True, "user": response.json()}
+            return {"success": True, "user": orjson.loads(response.content)}
         else:
-            return {"success": False, "message": response.json().get("detail", "Failed to get user info")}
-    except requests.exceptions.RequestException as e:
+            return {"success": False, "message": orjson.loads(response.content).get("detail", "Failed to get user info")}
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         st.error(f"Error: {str(e)}")
         logger.error(f"Auth error: {str(e)}")
         return {"success": False, "message": f"Error: {str(e)}"}
 
+def cached_user_info(token):
+    """Get user information, reusing the copy in session state while it's fresh"""
+    if "user" in st.session_state and time.monotonic() - st.session_state.get("user_fetched_at", 0) < USER_INFO_TTL:
+        return {"success": True, "user": st.session_state["user"]}
+    
+    user_info = get_user_info(token)
+    if user_info["success"]:
+        st.session_state["user"] = user_info["user"]
+        st.session_state["user_fetched_at"] = time.monotonic()
+    return user_info
+
+def count_scan_in_session():
+    """Count a finished scan against the cached profile, instead of refetching it"""
+    if "user" not in st.session_state:
+        return
+    subscription = st.session_state["user"]["subscription"]
+    subscription["scans_used"] += 1
+    # None means unlimited
+    if subscription["scans_remaining"] is not None:
+        subscription["scans_remaining"] = max(0, subscription["scans_remaining"] - 1)
+
+def expire_user_info():
+    """Make the next profile lookup hit the API, e.g. after a plan change"""
+    st.session_state.pop("user_fetched_at", None)
+
+# Button callbacks run before the rerun a click triggers, so that rerun
+# already draws the new state without a second st.rerun()
+def logout():
+    """Clear session state"""
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+
+def open_subscription_page():
+    """Go to the subscription page, refetching the profile there"""
+    st.session_state["page"] = "subscription"
+    expire_user_info()
+
 def display_login_page():
     """Display the login page"""
     st.title("🛡️ PhishGuard - Login")
@@ -79,11 +122,7 @@ def display_login_page():
     # Check if already logged in
     if "token" in st.session_state:
         st.success("You are already logged in!")
-        if st.button("Logout"):
-            # Clear session state
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
-            st.experimental_rerun()
+        st.button("Logout", on_click=logout)
         return
     
     # Create tabs for login and registration
@@ -109,12 +148,11 @@ def display_login_page():
                         st.session_state["token_type"] = result["token_type"]
                         
                         # Get user info
-                        user_info = get_user_info(result["token"])
-                        if user_info["success"]:
-                            st.session_state["user"] = user_info["user"]
+                        expire_user_info()
+                        cached_user_info(result["token"])
                         
                         st.success("Login successful!")
-                        st.experimental_rerun()
+                        st.rerun()
                     else:
                         st.error(result["message"])
     
@@ -149,17 +187,15 @@ def display_user_profile():
         st.warning("Please log in to view your profile")
         return
     
-    # Get user info if not already in session state
-    if "user" not in st.session_state:
-        user_info = get_user_info(st.session_state["token"])
-        if user_info["success"]:
-            st.session_state["user"] = user_info["user"]
-        else:
-            st.error(user_info["message"])
-            return
+    # Get user info unless session state has a fresh copy
+    user_info = cached_user_info(st.session_state["token"])
+    if not user_info["success"]:
+        st.error(user_info["message"])
+        return
     
-    user = st.session_state["user"]
+    user = user_info["user"]
     subscription = user["subscription"]
+    plan = subscription["plan"]
     
     # Display user info
     st.subheader("Account Information")
@@ -168,31 +204,24 @@ def display_user_profile():
     
     # Display subscription info
     st.subheader("Subscription Details")
-    st.write(f"**Current Plan:** {subscription['plan'].capitalize()}")
+    st.write(f"**Current Plan:** {plan.capitalize()}")
     
-    if subscription["plan"] == "free":
-        st.write(f"**Scans Used:** {subscription['scans_used']} of {subscription['scan_limit']}")
-        st.progress(min(1.0, subscription['scans_used'] / subscription['scan_limit']))
+    if plan == "free":
+        scans_used, scan_limit = subscription["scans_used"], subscription["scan_limit"]
+        st.write(f"**Scans Used:** {scans_used} of {scan_limit}")
+        st.progress(min(1.0, scans_used / scan_limit))
         
         # Upgrade button
-        if st.button("Upgrade to Pro"):
-            st.session_state["page"] = "subscription"
-            st.experimental_rerun()
+        st.button("Upgrade to Pro", on_click=open_subscription_page)
     else:
         st.write("**Scans Available:** Unlimited")
         st.write(f"**Status:** {subscription['status'].capitalize()}")
         
         # Manage subscription button
-        if st.button("Manage Subscription"):
-            st.session_state["page"] = "subscription"
-            st.experimental_rerun()
+        st.button("Manage Subscription", on_click=open_subscription_page)
     
     # Logout button
-    if st.button("Logout"):
-        # Clear session state
-        for key in list(st.session_state.keys()):
-            del st.session_state[key]
-        st.experimental_rerun()
+    st.button("Logout", on_click=logout)
 
 if __name__ == "__main__":
     display_login_page()
\ No newline at end of file
@@ -1,15 +1,37 @@
 import streamlit as st
-import pandas as pd
-import requests
 import os
 from frontend.auth import display_login_page
 from frontend.subscription import display_subscription_page
 from frontend.themes.theme_selector import display_theme_selector
+from frontend.api import API_URL, API_TIMEOUT, get_http_session
 
-BACKEND_URL = os.getenv("PHISHGUARD_BACKEND_URL", "http://localhost:8000")
+LOGO_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "themes", "phishguard_logo.png")
+
+@st.cache_resource
+def load_logo():
+    """Logo bytes, read from disk once per process; None if the file isn't shipped"""
+    try:
+        with open(LOGO_PATH, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+@st.cache_data(ttl=30, show_spinner=False)
+def fetch_history(limit: int):
+    """Recent analyses as a table, cached briefly so reruns don't refetch it.
+
+    Raises on any failure so that an error is never cached.
+    """
+    # pandas is only needed by the History tab; keep it off cold starts
+    import pandas as pd
+    resp = get_http_session().get(f"{API_URL}/phishing/history", params={"limit": limit}, timeout=API_TIMEOUT)
+    resp.raise_for_status()
+    return pd.DataFrame(resp.json().get("history", []))
 
 # --- Sidebar Navigation ---
-st.sidebar.image("/Volumes/Vladhard/PhishGuard/frontend/themes/phishguard_logo.png", width=150)
+logo = load_logo()
+if logo:
+    st.sidebar.image(logo, width=150)
 st.sidebar.title("PhishGuard")
 st.sidebar.markdown("## Navigation")
 nav = st.sidebar.radio(
@@ -33,26 +55,46 @@ st.markdown(
 )
 
 # --- Main Dashboard Content ---
-if nav == "Dashboard":
+@st.fragment
+def dashboard_tab():
+    """Upload-and-analyze section.
+
+    A fragment, so picking or clearing a file reruns only this section
+    instead of the whole page (sidebar, top bar and theme included).
+    """
     st.subheader("Analyze a Suspicious Email")
     uploaded_file = st.file_uploader("Upload an email file (.eml, .msg, .txt)", type=["eml", "msg", "txt"])
     analysis_result = None
     if uploaded_file is not None:
-        files = {"email_file": (uploaded_file.name, uploaded_file, uploaded_file.type)}
-        try:
-            response = requests.post(f"{BACKEND_URL}/phishing/analyze", files=files)
-            if response.status_code == 200:
-                analysis_result = response.json()
-                st.success("Analysis complete!")
-            else:
-                st.error(f"Analysis failed: {response.text}")
-        except Exception as e:
-            st.error(f"Could not connect to backend: {e}")
+        # The uploader keeps returning the same file on every rerun; only
+        # send it to the backend the first time, then reuse the result.
+        # file_id is new for every upload, even of a same-named, same-sized file.
+        upload_key = uploaded_file.file_id
+        if st.session_state.get("upload_key") == upload_key:
+            analysis_result = st.session_state["upload_result"]
+        else:
+            # Send the uploaded buffer itself rather than a copy of its bytes
+            files = {"email_file": (uploaded_file.name, uploaded_file.getbuffer(), uploaded_file.type)}
+            try:
+                response = get_http_session().post(f"{API_URL}/phishing/analyze", files=files, timeout=API_TIMEOUT)
+                if response.status_code == 200:
+                    analysis_result = response.json()
+                    st.session_state["upload_key"] = upload_key
+                    st.session_state["upload_result"] = analysis_result
+                    st.success("Analysis complete!")
+                else:
+                    st.error(f"Analysis failed: {response.text}")
+            except Exception as e:
+                st.error(f"Could not connect to backend: {e}")
 
     if analysis_result:
         st.markdown(f"**Risk Score:** {analysis_result.get('risk_score', 'N/A')}")
         st.markdown(f"**Summary:** {analysis_result.get('summary', 'No summary')}")
 
+
+if nav == "Dashboard":
+    dashboard_tab()
+
 # --- Subscription Section ---
 elif nav == "Subscription":
     st.header("Subscription & Billing")
@@ -70,20 +112,16 @@ elif nav == "Subscription":
 elif nav == "History":
     st.subheader("Recent Analyses")
     try:
-        resp = requests.get(f"{BACKEND_URL}/phishing/history?limit=5")
-        if resp.status_code == 200:
-            data = resp.json().get("history", [])
-        else:
-            data = []
+        df = fetch_history(5)
     except Exception:
-        data = []
-    if not data:
+        df = None
+    if df is None or df.empty:
+        import pandas as pd
         # Fallback example data
-        data = [
+        df = pd.DataFrame([
             {"Date": "2025-04-15", "Sender": "phisher@bad.com", "Subject": "Urgent action required!", "Risk Score": 95, "Report": "View"},
             {"Date": "2025-04-14", "Sender": "boss@company.com", "Subject": "Monthly update", "Risk Score": 5, "Report": "View"},
-        ]
-    df = pd.DataFrame(data)
+        ])
     st.table(df)
 
 # --- Feedback & Accessibility ---
@@ -2,117 +2,129 @@ import streamlit as st
 import requests
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from shared.logger import logger
+from frontend.api import API_URL, API_TIMEOUT, get_http_session
 
-# API endpoint
-API_URL = "https://phishguard-mcuv.onrender.com"
+def _api_request(method, path, token=None, **kwargs):
+    """Call the backend through the shared session; raises on any HTTP error"""
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    response = get_http_session().request(
+        method,
+        f"{API_URL}{path}",
+        headers=headers,
+        timeout=API_TIMEOUT,
+        **kwargs
+    )
+    response.raise_for_status()
+    return response.json()
+
+def _report_api_error(what, e):
+    """Show a failed call to the user and log it"""
+    st.error(f"Error {what}: {e}")
+    logger.error("Subscription API error: %s", e)
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_subscription_plans():
+    """Fetch the plan list; plans rarely change, so all sessions share it for an hour"""
+    return _api_request("GET", "/subscription/plans")["plans"]
+
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_user_subscription(token):
+    """Fetch a user's subscription status, reused per token for a minute"""
+    return _api_request("GET", "/subscription/status", token)["subscription"]
 
 def get_subscription_plans():
     """Get available subscription plans from API"""
     try:
-        response = requests.get(
-            f"{API_URL}/subscription/plans",
-            headers={"Content-Type": "application/json"}
-        )
-        response.raise_for_status()
-        return response.json()["plans"]
+        return fetch_subscription_plans()
     except requests.exceptions.RequestException as e:
-        st.error(f"Error fetching subscription plans: {str(e)}")
-        logger.error(f"Subscription API error: {str(e)}")
+        _report_api_error("fetching subscription plans", e)
         return None
 
 def get_user_subscription(token):
     """Get user's subscription status"""
     try:
-        response = requests.get(
-            f"{API_URL}/subscription/status",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
-        )
-        response.raise_for_status()
-        return response.json()["subscription"]
+        return fetch_user_subscription(token)
+    except requests.exceptions.RequestException as e:
+        _report_api_error("fetching subscription status", e)
+        return None
+
+def _result_or_report(future, what):
+    """Return a finished fetch's result, or report its error and return None"""
+    try:
+        return future.result()
     except requests.exceptions.RequestException as e:
-        st.error(f"Error fetching subscription status: {str(e)}")
-        logger.error(f"Subscription API error: {str(e)}")
+        _report_api_error(f"fetching {what}", e)
         return None
 
 def create_checkout_session(token, price_id, success_url, cancel_url):
     """Create a Stripe checkout session"""
     try:
-        response = requests.post(
-            f"{API_URL}/subscription/checkout",
+        return _api_request(
+            "POST",
+            "/subscription/checkout",
+            token,
             json={
                 "price_id": price_id,
                 "success_url": success_url,
                 "cancel_url": cancel_url
-            },
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
             }
         )
-        response.raise_for_status()
-        return response.json()
     except requests.exceptions.RequestException as e:
-        st.error(f"Error creating checkout session: {str(e)}")
-        logger.error(f"Subscription API error: {str(e)}")
+        _report_api_error("creating checkout session", e)
         return None
 
 def cancel_subscription(token):
     """Cancel user's subscription"""
     try:
-        response = requests.post(
-            f"{API_URL}/subscription/cancel",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
-        )
-        response.raise_for_status()
-        return response.json()
+        return _api_request("POST", "/subscription/cancel", token)
     except requests.exceptions.RequestException as e:
-        st.error(f"Error canceling subscription: {str(e)}")
-        logger.error(f"Subscription API error: {str(e)}")
+        _report_api_error("canceling subscription", e)
         return None
 
+def cancel_and_refresh(token):
+    """Cancel-button callback.
+
+    Runs before the rerun the click triggers, so clearing the cached status
+    here is enough for that rerun to show the new plan; no second rerun.
+    """
+    result = cancel_subscription(token)
+    if result:
+        fetch_user_subscription.clear(token)
+        st.session_state["subscription_notice"] = result["message"]
+
 def display_subscription_page():
     """Display the subscription page"""
     st.title("🛡️ PhishGuard Subscription Plans")
-    st.markdown("""
-        <style>
-        .pricing-card {
-            border: 1px solid #e6e6e6;
-            border-radius: 10px;
-            padding: 20px;
-            text-align: center;
-            transition: all 0.3s ease;
-        }
-        .pricing-card:hover {
-            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-            transform: translateY(-5px);
-        }
-        </style>
-        """, unsafe_allow_html=True)
     
     # Check if user is logged in
     if "token" not in st.session_state:
         st.warning("Please log in to manage your subscription")
         return
     
-    # Get user's subscription status
-    subscription = get_user_subscription(st.session_state["token"])
+    # Get user's subscription status and the available plans. Both are
+    # round trips to the same backend, so run them side by side; the cached
+    # fetchers are safe to call from worker threads and never draw anything.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        subscription_future = executor.submit(fetch_user_subscription, st.session_state["token"])
+        plans_future = executor.submit(fetch_subscription_plans)
+    
+    subscription = _result_or_report(subscription_future, "subscription status")
     if not subscription:
         st.error("Unable to fetch subscription information")
         return
     
-    # Get available plans
-    plans = get_subscription_plans()
+    plans = _result_or_report(plans_future, "subscription plans")
     if not plans:
         st.error("Unable to fetch subscription plans")
         return
     
+    if "subscription_notice" in st.session_state:
+        st.success(st.session_state.pop("subscription_notice"))
+    
     # Display current subscription
     st.subheader("Your Current Plan")
     
@@ -180,11 +192,7 @@ def display_subscription_page():
         st.subheader("Cancel Subscription")
         st.warning("Warning: Canceling your subscription will downgrade you to the Free plan at the end of your billing period.")
         
-        if st.button("Cancel Subscription"):
-            result = cancel_subscription(st.session_state["token"])
-            if result:
-                st.success(result["message"])
-                st.experimental_rerun()
+        st.button("Cancel Subscription", on_click=cancel_and_refresh, args=(st.session_state["token"],))
 
 if __name__ == "__main__":
     display_subscription_page()
\ No newline at end of file
@@ -1,21 +1,23 @@
 import streamlit as st
-from frontend.themes.modern import apply_modern_theme
-from frontend.themes.cyber import apply_cyber_theme
-from frontend.themes.friendly import apply_friendly_theme
+
+# Each theme's stylesheet is served from static/themes/ (see
+# .streamlit/config.toml), so each rerun only sends a link tag instead of the
+# whole theme. Their fonts are part of the single Google Fonts request in the
+# app's page head.
+THEME_STYLESHEETS = {
+    'modern': 'app/static/themes/modern.css',
+    'cyber': 'app/static/themes/cyber.css',
+    'friendly': 'app/static/themes/friendly.css'
+}
 
 def initialize_theme_selector():
     if 'theme' not in st.session_state:
         st.session_state.theme = 'modern'
 
 def apply_selected_theme():
-    theme_map = {
-        'modern': apply_modern_theme,
-        'cyber': apply_cyber_theme,
-        'friendly': apply_friendly_theme
-    }
-    
     # Apply the selected theme
-    theme_map[st.session_state.theme]()
+    stylesheet = THEME_STYLESHEETS[st.session_state.theme]
+    st.markdown(f'<link rel="stylesheet" href="{stylesheet}">', unsafe_allow_html=True)
 
 def display_theme_selector():
     initialize_theme_selector()
@@ -1,6 +1,12 @@
 import os
-from openai import OpenAI
-from typing import Dict, List, Optional, Any
+import re
+import asyncio
+import hashlib
+import threading
+from functools import cache
+from cachetools import TTLCache
+from openai import OpenAI, AsyncOpenAI
+from typing import Dict, List, Optional, Any, Tuple
 import logging
 from dotenv import load_dotenv
 
@@ -9,15 +15,33 @@ load_dotenv()
 
 # Configure OpenAI API
 api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
 GPT_MODEL = os.getenv("GPT_MODEL", "gpt-3.5-turbo")
 MAX_TOKENS = int(os.getenv("MAX_TOKENS", "500"))
+# Most GPT requests analyze_email_with_gpt_async keeps in flight per process
+MAX_CONCURRENT_GPT_CALLS = int(os.getenv("MAX_CONCURRENT_GPT_CALLS", "32"))
+_gpt_call_slots = asyncio.Semaphore(MAX_CONCURRENT_GPT_CALLS)
+# Successful GPT verdicts by email content, so a resubmitted email costs no
+# second API call or tokens. Failures are never cached.
+_gpt_result_lock = threading.Lock()
+_gpt_result_cache = TTLCache(maxsize=10_000, ttl=24 * 60 * 60)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# The clients are built on first use rather than at import, so processes that
+# never reach a borderline email (or have no API key) don't pay for them
+@cache
+def get_openai_client() -> OpenAI:
+    return OpenAI(api_key=api_key)
+
+
+@cache
+def get_async_openai_client() -> AsyncOpenAI:
+    return AsyncOpenAI(api_key=api_key)
+
+
 def should_use_gpt(risk_score: float, risk_factors: List[str]) -> bool:
     """
     Determine if we should use GPT for enhanced analysis based on risk score and factors.
@@ -34,25 +58,121 @@ def should_use_gpt(risk_score: float, risk_factors: List[str]) -> bool:
     Returns:
         bool: True if GPT analysis should be used, False otherwise
     """
-    # Skip GPT for very low risk emails (clearly safe)
-    if risk_score < 0.2:
+    # Skip GPT for very low risk emails (clearly safe) and very high risk
+    # emails (clearly dangerous)
+    if not 0.2 <= risk_score <= 0.8:
         return False
     
-    # Skip GPT for very high risk emails (clearly dangerous)
-    if risk_score > 0.8:
-        return False
+    # For borderline cases, use GPT if we have few risk factors (we're
+    # uncertain and need more insights) or the score sits in the "gray area"
+    # where AI can help the most
+    return len(risk_factors) < 3 or 0.4 <= risk_score <= 0.6
+
+
+GPT_SYSTEM_PROMPT = "You are a cybersecurity expert specializing in phishing detection."
+NO_FINDINGS_REPLY = "No additional suspicious elements found"
+# One numbered ("1. ...") or bulleted ("- ...") item per line; group 1 is the item text
+LIST_ITEM_PATTERN = re.compile(r"^[ \t]*(?:\d+\.|-)[ \t]+(.+?)\s*$", re.MULTILINE)
+
+
+def build_gpt_prompt(subject: str, body: str, sender: str, existing_risk_factors: List[str]) -> str:
+    """Build the user prompt asking GPT for risk factors we haven't found yet."""
+    return f"""
+        Analyze this email for phishing indicators. Identify any suspicious elements not in the existing risk factors.
+        
+        Subject: {subject}
+        From: {sender}
+        Body: {body}
+        
+        Existing risk factors: {', '.join(existing_risk_factors)}
+        
+        Provide ONLY new suspicious elements in this format:
+        1. [Specific suspicious element with brief explanation]
+        2. [Another suspicious element with brief explanation]
+        
+        If you find nothing new, respond with "No additional suspicious elements found."
+        """
+
+
+def parse_gpt_risk_factors(gpt_analysis: str) -> List[str]:
+    """Turn GPT's numbered or bulleted reply into "GPT detected: ..." risk factors."""
+    if NO_FINDINGS_REPLY in gpt_analysis:
+        return []
+    return [f"GPT detected: {match.group(1)}" for match in LIST_ITEM_PATTERN.finditer(gpt_analysis)]
+
+
+def _gpt_cache_key(subject: str, body: str, sender: str, existing_risk_factors: List[str]) -> str:
+    """Digest of everything that goes into the prompt, so the cache doesn't hold email bodies"""
+    digest = hashlib.sha256()
+    for part in (subject, body, sender, *existing_risk_factors):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _cached_gpt_result(key: str) -> Optional[Dict[str, Any]]:
+    with _gpt_result_lock:
+        return _gpt_result_cache.get(key)
+
+
+def _cache_gpt_result(key: str, result: Dict[str, Any]) -> None:
+    with _gpt_result_lock:
+        _gpt_result_cache[key] = result
+
+
+def _prepare_gpt_analysis(
+    subject: str, 
+    body: str, 
+    sender: str, 
+    existing_risk_factors: List[str]
+) -> Tuple[Optional[Dict[str, Any]], Optional[str], Optional[Dict[str, Any]]]:
+    """
+    Everything both analyze functions do before calling OpenAI.
     
-    # For borderline cases, use GPT if we have few risk factors
-    # This helps when we're uncertain and need more insights
-    if 0.2 <= risk_score <= 0.8 and len(risk_factors) < 3:
-        return True
+    Returns (result, cache_key, request). result is set when no API call is
+    needed (no API key, or a cached verdict); otherwise request holds the
+    arguments for chat.completions.create.
+    """
+    if not api_key:
+        logger.warning("OpenAI API key not found. Skipping GPT analysis.")
+        return {"success": False, "additional_risk_factors": [], "error": "API key not configured"}, None, None
     
-    # Use GPT if we have a moderate risk score
-    # This is the "gray area" where AI can help the most
-    if 0.4 <= risk_score <= 0.6:
-        return True
+    key = _gpt_cache_key(subject, body, sender, existing_risk_factors)
+    cached = _cached_gpt_result(key)
+    if cached is not None:
+        return cached, key, None
     
-    return False
+    request = {
+        "model": GPT_MODEL,
+        "messages": [{"role": "system", "content": GPT_SYSTEM_PROMPT},
+                     {"role": "user", "content": build_gpt_prompt(subject, body, sender, existing_risk_factors)}],
+        "max_tokens": MAX_TOKENS,
+        "temperature": 0.3  # Lower temperature for more focused, analytical responses
+    }
+    return None, key, request
+
+
+def _finish_gpt_analysis(key: str, response: Any) -> Dict[str, Any]:
+    """Turn GPT's reply into the result dict, and cache it under the email's key"""
+    gpt_analysis = response.choices[0].message.content.strip()
+    
+    result = {
+        "success": True,
+        "additional_risk_factors": parse_gpt_risk_factors(gpt_analysis),
+        "error": None
+    }
+    _cache_gpt_result(key, result)
+    return result
+
+
+def _gpt_error_result(e: Exception) -> Dict[str, Any]:
+    """Log a failed GPT analysis and build its (uncached) result dict"""
+    logger.error(f"Error in GPT analysis: {str(e)}")
+    return {
+        "success": False,
+        "additional_risk_factors": [],
+        "error": str(e)
+    }
 
 
 def analyze_email_with_gpt(
@@ -77,63 +197,42 @@ def analyze_email_with_gpt(
             - error: Error message if analysis failed
     """
     try:
-        # Prepare the prompt for GPT
-        prompt = f"""
-        Analyze this email for phishing indicators. Identify any suspicious elements not in the existing risk factors.
-        
-        Subject: {subject}
-        From: {sender}
-        Body: {body}
-        
-        Existing risk factors: {', '.join(existing_risk_factors)}
-        
-        Provide ONLY new suspicious elements in this format:
-        1. [Specific suspicious element with brief explanation]
-        2. [Another suspicious element with brief explanation]
-        
-        If you find nothing new, respond with "No additional suspicious elements found."
-        """
+        result, key, request = _prepare_gpt_analysis(subject, body, sender, existing_risk_factors)
+        if result is not None:
+            return result
         
         # Call the OpenAI API
-        if not api_key:
-            logger.warning("OpenAI API key not found. Skipping GPT analysis.")
-            return {"success": False, "additional_risk_factors": [], "error": "API key not configured"}
+        response = get_openai_client().chat.completions.create(**request)
         
-        response = client.chat.completions.create(
-            model=GPT_MODEL,
-            messages=[{"role": "system", "content": "You are a cybersecurity expert specializing in phishing detection."},
-                     {"role": "user", "content": prompt}],
-            max_tokens=MAX_TOKENS,
-            temperature=0.3  # Lower temperature for more focused, analytical responses
-        )
+        return _finish_gpt_analysis(key, response)
         
-        # Process the response
-        gpt_analysis = response.choices[0].message.content.strip()
+    except Exception as e:
+        return _gpt_error_result(e)
+
+
+async def analyze_email_with_gpt_async(
+    subject: str, 
+    body: str, 
+    sender: str, 
+    existing_risk_factors: List[str]
+) -> Dict[str, Any]:
+    """
+    Async version of analyze_email_with_gpt for use on an event loop.
+    
+    The request waits on the network without holding a worker thread, and at
+    most MAX_CONCURRENT_GPT_CALLS requests are in flight at once so bursts of
+    borderline emails queue here instead of hitting OpenAI's rate limits.
+    Returns the same dict as analyze_email_with_gpt.
+    """
+    try:
+        result, key, request = _prepare_gpt_analysis(subject, body, sender, existing_risk_factors)
+        if result is not None:
+            return result
         
-        # Extract new risk factors
-        additional_factors = []
-        if "No additional suspicious elements found" not in gpt_analysis:
-            # Split by numbered list items and filter out empty lines
-            for line in gpt_analysis.split("\n"):
-                # Look for numbered list items or bullet points
-                if (line.strip() and (line.strip()[0].isdigit() and ". " in line or 
-                                      line.strip().startswith("- "))):
-                    # Clean up the line and add "GPT detected" prefix
-                    factor = line.strip()
-                    # Remove the number/bullet and any leading/trailing whitespace
-                    factor = factor.split(".", 1)[1].strip() if ". " in factor else factor[2:].strip()
-                    additional_factors.append(f"GPT detected: {factor}")
+        async with _gpt_call_slots:
+            response = await get_async_openai_client().chat.completions.create(**request)
         
-        return {
-            "success": True,
-            "additional_risk_factors": additional_factors,
-            "error": None
-        }
+        return _finish_gpt_analysis(key, response)
         
     except Exception as e:
-        logger.error(f"Error in GPT analysis: {str(e)}")
-        return {
-            "success": False,
-            "additional_risk_factors": [],
-            "error": str(e)
-        }
\ No newline at end of file
+        return _gpt_error_result(e)